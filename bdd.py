@@ -0,0 +1,203 @@
+from boolean import BooleanValue, F, T
+from expression import Expression, Literal, postorder, TruthTableEngine, Variable
+from operation import Operation
+from truthtable import TruthTable
+
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+
+
+__all__ = [
+    "BDD",
+    "BDDEngine"
+]
+
+
+# A reduced ordered binary decision diagram manager.
+# Nodes are identified by ints: 0 and 1 are the F and T terminals, and every other node tests one variable, branching
+# to its low (variable is F) and high (variable is T) children. The unique table guarantees that equal functions are
+# the same node, so many functions can share one manager.
+class BDD:
+    false = 0
+    true = 1
+
+    def __init__(self, variables: Sequence[str] = ()) -> None:
+        # Variable names in order of level, i.e. the variable order.
+        self.names: List[str] = []
+        self.levels: Dict[str, int] = {}
+        # (level, low, high) for each node. The terminals have level None.
+        self.nodes: List[Tuple[Optional[int], int, int]] = [(None, 0, 0), (None, 1, 1)]
+        self.unique: Dict[Tuple[int, int, int], int] = {}
+        self.ite_cache: Dict[Tuple[int, int, int], int] = {}
+        for name in variables:
+            self.variable(name)
+
+    @property
+    def num_vars(self) -> int:
+        return len(self.names)
+
+    def level(self, node: int) -> int:
+        level = self.nodes[node][0]
+        return self.num_vars if level is None else level
+
+    def is_terminal(self, node: int) -> bool:
+        return node <= 1
+
+    # Gets the node for the function which is just the given variable. New variables are ordered after existing ones.
+    def variable(self, name: str) -> int:
+        level = self.levels.get(name)
+        if level is None:
+            level = len(self.names)
+            self.names.append(name)
+            self.levels[name] = level
+        return self.make_node(level, self.false, self.true)
+
+    def constant(self, value: BooleanValue) -> int:
+        return self.true if value else self.false
+
+    def make_node(self, level: int, low: int, high: int) -> int:
+        if low == high:
+            return low
+        key = (level, low, high)
+        node = self.unique.get(key)
+        if node is None:
+            node = len(self.nodes)
+            self.nodes.append(key)
+            self.unique[key] = node
+        return node
+
+    # Cofactors of node with respect to the variable at level.
+    def cofactors(self, node: int, level: int) -> Tuple[int, int]:
+        node_level, low, high = self.nodes[node]
+        if node_level == level:
+            return low, high
+        else:
+            return node, node
+
+    # If-then-else: the function (f & g) | (~f & h).
+    def ite(self, f: int, g: int, h: int) -> int:
+        if f == self.true:
+            return g
+        if f == self.false:
+            return h
+        if g == h:
+            return g
+        if g == self.true and h == self.false:
+            return f
+        key = (f, g, h)
+        result = self.ite_cache.get(key)
+        if result is None:
+            level = min(self.level(f), self.level(g), self.level(h))
+            f0, f1 = self.cofactors(f, level)
+            g0, g1 = self.cofactors(g, level)
+            h0, h1 = self.cofactors(h, level)
+            result = self.make_node(level, self.ite(f0, g0, h0), self.ite(f1, g1, h1))
+            self.ite_cache[key] = result
+        return result
+
+    def negate(self, f: int) -> int:
+        return self.ite(f, self.false, self.true)
+
+    # Applies the operator described by a join table to operand nodes, by Shannon expansion over the operands.
+    def apply(self, join: TruthTable, operands: Sequence[int]) -> int:
+        def expand(prefix: Tuple[BooleanValue, ...]) -> int:
+            if len(prefix) == len(operands):
+                return self.constant(join[prefix])
+            return self.ite(operands[len(prefix)], expand(prefix + (T,)), expand(prefix + (F,)))
+
+        return expand(())
+
+    def from_expression(self, expr: Expression) -> int:
+        nodes: Dict[Expression, int] = {}
+        for subexpr in postorder(expr):
+            if isinstance(subexpr, Literal):
+                node = self.constant(subexpr.value)
+            elif isinstance(subexpr, Variable):
+                node = self.variable(subexpr.name)
+            elif isinstance(subexpr, Operation):
+                node = self.apply(subexpr.join, [nodes[operand] for operand in subexpr.operands])
+            else:
+                raise TypeError(f"Can't build a BDD from `{type(subexpr)}`.")
+            nodes[subexpr] = node
+        return nodes[expr]
+
+    # Finds a partial assignment, by variable name, for which node evaluates to value. Variables not in the assignment
+    # don't affect the result. Returns None if there is no such assignment.
+    def find_assignment(self, node: int, value: BooleanValue) -> Optional[Dict[str, BooleanValue]]:
+        target = self.constant(value)
+        other = self.constant(F if value else T)
+        if node == other:
+            return None
+        assignment: Dict[str, BooleanValue] = {}
+        # Every non-terminal node of a reduced BDD can reach both terminals, so we can't take a wrong turn.
+        while not self.is_terminal(node):
+            level, low, high = self.nodes[node]
+            if low != other:
+                assignment[self.names[level]] = F
+                node = low
+            else:
+                assignment[self.names[level]] = T
+                node = high
+        assert node == target
+        return assignment
+
+    # Counts the assignments of all the manager's variables for which node is T.
+    def count(self, node: int) -> int:
+        # Maps nodes to their count over the variables from their level onwards.
+        counts = {self.false: 0, self.true: 1}
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if current in counts:
+                stack.pop()
+                continue
+            level, low, high = self.nodes[current]
+            pending = [child for child in (low, high) if child not in counts]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            counts[current] = (counts[low] << (self.level(low) - level - 1)) + (counts[high] << (self.level(high) - level - 1))
+        return counts[node] << self.level(node)
+
+    def clear_cache(self) -> None:
+        self.ite_cache.clear()
+
+
+# Answers questions about expressions using a shared BDD, instead of truth tables.
+class BDDEngine(TruthTableEngine):
+    def __init__(self, manager: Optional[BDD] = None) -> None:
+        self.manager = BDD() if manager is None else manager
+        self.roots: "WeakKeyDictionary[Expression, int]" = WeakKeyDictionary()
+
+    def node(self, expr: Expression) -> int:
+        node = self.roots.get(expr)
+        if node is None:
+            node = self.manager.from_expression(expr)
+            self.roots[expr] = node
+        return node
+
+    def values(self, expr: Expression) -> FrozenSet[BooleanValue]:
+        node = self.node(expr)
+        if node == BDD.false:
+            return frozenset((F,))
+        elif node == BDD.true:
+            return frozenset((T,))
+        else:
+            return frozenset((F, T))
+
+    def count(self, expr: Expression, value: BooleanValue) -> int:
+        node = self.node(expr)
+        # Variables in the manager but not in the expression double the count without affecting it.
+        num_other_vars = self.manager.num_vars - len(expr.variables)
+        num_true = self.manager.count(node) >> num_other_vars
+        return num_true if value else (1 << len(expr.variables)) - num_true
+
+    def probability(self, expr: Expression, value: BooleanValue) -> float:
+        return self.count(expr, value) / (1 << len(expr.variables))
+
+    def find_assignment(self, expr: Expression, value: BooleanValue) -> Optional[Dict[str, BooleanValue]]:
+        assignment = self.manager.find_assignment(self.node(expr), value)
+        if assignment is None:
+            return None
+        return {var.name: assignment.get(var.name, F) for var in expr.variables}
@@ -0,0 +1,294 @@
+from boolean import F, T
+import expression
+from expression import postorder, precompute_truth
+import exprparse
+import exprutility
+import fileconvert
+
+import argparse
+from contextlib import redirect_stderr, redirect_stdout
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# Generates the text of a random expression with num_leaves leaves over num_vars variables, as one long string.
+# With many variables, few subexpressions are equal, so interning doesn't shrink the tree much.
+def large_expression_string(num_leaves: int, num_vars: int, rng: random.Random) -> str:
+    names = [f"{a}{b}{c}" for a in "abcdefghijklmnopqrstuvwxyz" for b in "abcdefghijklmnopqrstuvwxyz" for c in "abcdefghijklmnopqrstuvwxyz"]
+    names = names[:num_vars]
+    operators = ["&", "|", "+", "->", "<->"]
+    # Joins leaves in random pairs until one remains, so the tree has depth about log(num_leaves).
+    parts: List[str] = [rng.choice(names) if rng.random() < 0.9 else rng.choice("TF") for _ in range(num_leaves)]
+    while len(parts) > 1:
+        joined: List[str] = []
+        for i in range(0, len(parts) - 1, 2):
+            lhs = parts[i] if rng.random() < 0.8 else f"~{parts[i]}"
+            joined.append(f"({lhs} {rng.choice(operators)} {parts[i + 1]})")
+        if len(parts) % 2:
+            joined.append(parts[-1])
+        parts = joined
+    return parts[0]
+
+
+# Measures the memory allocated by function, and still held by its result, in bytes.
+def measure_memory(function: Callable[[], Any]) -> Tuple[Any, int]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+# A benchmark result: (name, value, unit, whether higher values are better).
+Result = Tuple[str, float, str, bool]
+
+# Version of the JSON results format written by --output.
+results_version = 1
+
+
+# Measures the time function takes, in seconds, as the best of repeats samples of number calls.
+def measure_time(function: Callable[[], Any], repeats: int, number: int = 1) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def memory_benchmark(rng: random.Random, quick: bool) -> List[Result]:
+    num_leaves = 20000 if quick else 200000
+    source = large_expression_string(num_leaves, 5000, rng)
+
+    tokens, tokens_size = measure_memory(lambda: exprparse.parse_tokens(source))
+    num_tokens = len(tokens)
+    del tokens
+
+    expr, expr_size = measure_memory(lambda: exprparse.parse(source))
+    num_nodes = sum(1 for _ in postorder(expr))
+    return [
+        (f"memory.tokens[{num_leaves} leaves]", tokens_size / num_tokens, "B/token", False),
+        (f"memory.expression[{num_leaves} leaves]", expr_size / num_nodes, "B/node", False)
+    ]
+
+
+# Parse throughput for expressions of increasing length. Recently used expressions aren't retained, so each parse
+# builds every node instead of finding them interned from the previous one.
+def parse_benchmark(rng: random.Random, quick: bool) -> List[Result]:
+    results: List[Result] = []
+    retained = expression.recent_expressions.maxlen
+    expression.retain_expressions(0)
+    try:
+        for num_leaves in ((100, 1000, 10000) if quick else (100, 1000, 10000, 100000)):
+            source = large_expression_string(num_leaves, 50, rng)
+            seconds = measure_time(lambda: exprparse.parse(source), 3 if quick else 5, max(1, 20000 // num_leaves))
+            results.append((f"parse[{num_leaves} leaves]", len(source) / seconds / 1e6, "MB/s", True))
+    finally:
+        expression.retain_expressions(retained)
+    return results
+
+
+# Truth table computation time and retained memory, by number of variables and expression depth. Recently used
+# expressions aren't retained, so each run computes every truth table from scratch.
+def truth_benchmark(rng: random.Random, quick: bool) -> List[Result]:
+    results: List[Result] = []
+    retained = expression.recent_expressions.maxlen
+    expression.retain_expressions(0)
+    try:
+        for num_vars in ((4, 8) if quick else (4, 8, 16)):
+            for depth in ((4, 8) if quick else (4, 8, 12)):
+                source = large_expression_string(2 ** depth, num_vars, rng)
+                seconds = float("inf")
+                for _ in range(3):
+                    expr = exprparse.parse(source)
+                    gc.collect()
+                    start = time.perf_counter()
+                    precompute_truth(expr)
+                    seconds = min(seconds, time.perf_counter() - start)
+                    del expr
+                _, memory = measure_memory(lambda: precompute_truth_of(source))
+                results.append((f"truth.time[{num_vars} vars, depth {depth}]", seconds * 1e3, "ms", False))
+                results.append((f"truth.memory[{num_vars} vars, depth {depth}]", memory / 1e3, "kB", False))
+    finally:
+        expression.retain_expressions(retained)
+    return results
+
+
+# Parses source and computes the truth tables of it and its subexpressions, returning the expression.
+def precompute_truth_of(source: str) -> expression.Expression:
+    expr = exprparse.parse(source)
+    precompute_truth(expr)
+    return expr
+
+
+# Rate of generating random expressions with a given value.
+def generate_benchmark(rng: random.Random, quick: bool) -> List[Result]:
+    results: List[Result] = []
+    count = 200 if quick else 2000
+    for max_vars, max_depth in ((4, 5), (8, 7)):
+        seconds = measure_time(lambda: [exprutility.random_expression_with_value(max_vars, max_depth, (F, T)[i % 2], rng)
+                                        for i in range(count)], 3)
+        results.append((f"random_expression_with_value[{max_vars} vars, depth {max_depth}]", count / seconds, "exprs/s", True))
+    return results
+
+
+# End to end fileconvert throughput on random data, in MB/s of the data (not of its encoded form).
+def fileconvert_benchmark(rng: random.Random, quick: bool) -> List[Result]:
+    size = 1024 if quick else 8192
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = os.path.join(directory, "data")
+        encoded_path = os.path.join(directory, "encoded")
+        decoded_path = os.path.join(directory, "decoded")
+        with open(data_path, mode="wb") as file:
+            file.write(bytes(rng.getrandbits(8) for _ in range(size)))
+        seed = rng.getrandbits(32)
+
+        def encode() -> None:
+            remove_file(encoded_path)
+            quietly(lambda: fileconvert.encode(data_path, encoded_path, seed=seed))
+
+        def decode() -> None:
+            remove_file(decoded_path)
+            quietly(lambda: fileconvert.decode(encoded_path, decoded_path))
+
+        encode_seconds = measure_time(encode, 1 if quick else 3)
+        decode_seconds = measure_time(decode, 1 if quick else 3)
+        with open(data_path, mode="rb") as data, open(decoded_path, mode="rb") as decoded:
+            if data.read() != decoded.read():
+                raise RuntimeError("Decoded data doesn't match the original.")
+    return [
+        ("fileconvert.encode", size / encode_seconds / 1e6, "MB/s", True),
+        ("fileconvert.decode", size / decode_seconds / 1e6, "MB/s", True)
+    ]
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Calls function with its output and progress bars discarded.
+def quietly(function: Callable[[], Any]) -> Any:
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        return function()
+
+
+benchmarks: Dict[str, Callable[[random.Random, bool], List[Result]]] = {
+    "parse": parse_benchmark,
+    "memory": memory_benchmark,
+    "truth": truth_benchmark,
+    "generate": generate_benchmark,
+    "fileconvert": fileconvert_benchmark
+}
+
+
+# Runs the named benchmarks, printing results as they complete. Each benchmark's random number generator is seeded
+# from seed and its name, so its inputs don't depend on which other benchmarks run.
+def run_benchmarks(names: Sequence[str], seed: int, quick: bool) -> List[Result]:
+    results: List[Result] = []
+    for name in names:
+        for result in benchmarks[name](random.Random(f"{seed}:{name}"), quick):
+            print(f"{result[0]:<50} {result[1]:>12.4g} {result[2]}")
+            results.append(result)
+    return results
+
+
+def results_to_json(results: Sequence[Result], seed: int, quick: bool) -> Dict[str, Any]:
+    return {
+        "version": results_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "quick": quick,
+        "results": {name: {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+                    for name, value, unit, higher_is_better in results}
+    }
+
+
+# Compares results to a baseline loaded from JSON, printing the change in each result both have. Returns the names of
+# results which got worse by more than threshold (a fraction of the baseline value).
+def compare_results(results: Sequence[Result], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions: List[str] = []
+    baseline_results: Dict[str, Any] = baseline["results"]
+    for name, value, unit, higher_is_better in results:
+        if name not in baseline_results:
+            print(f"{name:<50} (not in baseline)")
+            continue
+        old = baseline_results[name]["value"]
+        change = value / old - 1 if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif -worse > threshold:
+            flag = "  improvement"
+        print(f"{name:<50} {old:>12.4g} -> {value:<12.4g} {unit:<8} {change:+.1%}{flag}")
+    return regressions
+
+
+def main(args: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Measures the library's performance.")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help=f"benchmarks to run: {', '.join(benchmarks)} (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--quick", action="store_true", help="use smaller inputs, for a fast rough check")
+    parser.add_argument("--output", metavar="RESULTS_FILE", help="file to save the results to, as JSON")
+    parser.add_argument("--compare", metavar="BASELINE_FILE", help="results file to compare the results to")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fraction by which a result must get worse to count as a regression (default: 0.2)")
+    args = parser.parse_args(args)
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error(f'Unknown benchmark "{name}".')
+    if args.threshold < 0:
+        parser.error("--threshold must be >= 0.")
+
+    baseline: Optional[Dict[str, Any]] = None
+    if args.compare is not None:
+        try:
+            with open(args.compare, mode="r", encoding="utf-8") as file:
+                baseline = json.load(file)
+        except (OSError, ValueError):
+            print(f'Failed to read baseline "{args.compare}".')
+            sys.exit(2)
+        if baseline.get("version") != results_version:
+            print(f'Unsupported baseline version in "{args.compare}".')
+            sys.exit(2)
+
+    results = run_benchmarks(args.names or list(benchmarks), args.seed, args.quick)
+
+    if args.output is not None:
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            json.dump(results_to_json(results, args.seed, args.quick), file, indent=2)
+
+    if baseline is not None:
+        print()
+        print(f"Compared to {args.compare}:")
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}.")
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,10 @@ class BooleanValue:
     def __repr__(self) -> str:
         return self.__class__.__name__ + "()"
 
+    # Pickles as a reference to the module-level F or T, so unpickling preserves identity.
+    def __reduce__(self) -> str:
+        return str(self)
+
 
 class FalseType(BooleanValue):
     value = False
@@ -0,0 +1,114 @@
+from boolean import BooleanValue, F, T
+from expression import Expression, Literal, postorder, Variable
+from operation import bitwise_function, Operation
+
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+from weakref import WeakKeyDictionary
+
+import numpy
+
+
+__all__ = [
+    "CompiledExpression",
+    "compile_expression",
+    "evaluate"
+]
+
+
+# An expression compiled to a straight-line Python function, which evaluates it on single assignments or on whole
+# columns of assignments at once.
+# The function computes every node with the operations' bitwise forms, so the same code runs on Python ints, NumPy
+# boolean arrays and packed uint64 words. Bitwise operations never mix bit positions, so the result only needs masking
+# at the end.
+# It keeps no reference to the expression, which is the key of its entry in compiled_expressions.
+class CompiledExpression:
+    def __init__(self, expr: Expression) -> None:
+        nodes = list(postorder(expr))
+        variables = [node for node in nodes if isinstance(node, Variable)]
+        # Variable names, in the order the function takes them.
+        self.variables: Tuple[str, ...] = tuple(var.name for var in variables)
+
+        index = {node: i for i, node in enumerate(nodes)}
+        namespace: Dict[str, Any] = {}
+        lines: List[str] = []
+        for i, node in enumerate(nodes):
+            if isinstance(node, Operation):
+                function_name = f"op{i}"
+                namespace[function_name] = bitwise_function(node)
+                operands = ", ".join(f"v{index[operand]}" for operand in node.operands)
+                lines.append(f"    v{i} = {function_name}({operands})")
+            elif isinstance(node, Literal):
+                lines.append(f"    v{i} = {'mask' if node.value else 'zero'}")
+            elif not isinstance(node, Variable):
+                raise TypeError(f"Can't compile `{type(node)}`.")
+        params = [f"v{index[var]}" for var in variables] + ["mask", "zero"]
+        lines.append(f"    return v{len(nodes) - 1} & mask")
+        self.source = f"def evaluate({', '.join(params)}):\n" + "\n".join(lines) + "\n"
+        exec(compile(self.source, f"<compiled {type(expr).__name__}>", "exec"), namespace)
+        self.function: Callable[..., Any] = namespace["evaluate"]
+
+    # Evaluates the expression for one assignment of its variables, by name.
+    def __call__(self, assignment: Mapping[str, Union[bool, BooleanValue]]) -> BooleanValue:
+        args = [int(bool(assignment[name])) for name in self.variables]
+        return T if self.function(*args, 1, 0) else F
+
+    # Evaluates the expression for many assignments, given as a column of values for each variable, by name.
+    # Returns a boolean array with the result for each assignment. size gives the number of assignments, and is only
+    # needed if the expression has no variables.
+    def evaluate(self, assignments: Mapping[str, Sequence[Union[bool, BooleanValue]]], size: Optional[int] = None) -> numpy.ndarray:
+        columns = [as_bool_column(assignments[name]) for name in self.variables]
+        length = column_length(columns, size)
+        result = self.function(*columns, numpy.bool_(True), numpy.bool_(False))
+        return numpy.array(numpy.broadcast_to(result, (length,)))
+
+    # Like evaluate(), but with columns packed 64 assignments per uint64 word (as by truthtable.pack_column()). If size
+    # is given, bits past the last assignment are cleared.
+    def evaluate_packed(self, assignments: Mapping[str, numpy.ndarray], size: Optional[int] = None) -> numpy.ndarray:
+        columns = [numpy.asarray(assignments[name], dtype=numpy.uint64) for name in self.variables]
+        length = column_length(columns, None if size is None else (size + 63) // 64)
+        ones = numpy.uint64(0xFFFFFFFFFFFFFFFF)
+        result = self.function(*columns, ones, numpy.uint64(0))
+        result = numpy.array(numpy.broadcast_to(result, (length,)))
+        if size is not None:
+            if size > length * 64:
+                raise ValueError("size is larger than the columns.")
+            result[(size + 63) // 64:] = 0
+            if size % 64:
+                result[size // 64] &= numpy.uint64((1 << (size % 64)) - 1)
+        return result
+
+
+def column_length(columns: Sequence[numpy.ndarray], default: Optional[int]) -> int:
+    lengths = {len(column) for column in columns}
+    if len(lengths) > 1:
+        raise ValueError("All columns must be the same length.")
+    if lengths:
+        return lengths.pop()
+    elif default is not None:
+        return default
+    else:
+        raise ValueError("size is required to evaluate an expression without variables.")
+
+
+def as_bool_column(column: Sequence[Union[bool, BooleanValue]]) -> numpy.ndarray:
+    array = numpy.asarray(column)
+    if array.dtype != bool:
+        array = numpy.fromiter(map(bool, array.ravel()), dtype=bool, count=array.size)
+    return array
+
+
+compiled_expressions: "WeakKeyDictionary[Expression, CompiledExpression]" = WeakKeyDictionary()
+
+
+# Compiles an expression, reusing the previous compilation of an equal expression.
+def compile_expression(expr: Expression) -> CompiledExpression:
+    compiled = compiled_expressions.get(expr)
+    if compiled is None:
+        compiled = CompiledExpression(expr)
+        compiled_expressions[expr] = compiled
+    return compiled
+
+
+# Evaluates an expression for a column of assignments of each variable, by name. See CompiledExpression.evaluate().
+def evaluate(expr: Expression, assignments: Mapping[str, Sequence[Union[bool, BooleanValue]]], size: Optional[int] = None) -> numpy.ndarray:
+    return compile_expression(expr).evaluate(assignments, size)
@@ -0,0 +1,138 @@
+from boolean import BooleanValue, F, from_bool, T
+from exprutility import random_expression
+from lazyeval import exact_value
+from operation import BinaryOperation, binary_operations, Negation
+
+import argparse
+import gzip
+from itertools import product
+import random
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+
+__all__ = [
+    "BankFormatError",
+    "ExpressionBank"
+]
+
+
+class BankFormatError(Exception):
+    pass
+
+
+# Identifies expression bank files, followed by the format version.
+bank_magic = "exprbank"
+bank_version = 1
+
+
+# Pools of expression strings known to evaluate to T and to F, for drawing expressions with a given value without
+# generating and checking them each time.
+# Drawn expressions can be recombined: joined by an operation with operands drawn from the pools whose values make the
+# operation evaluate to the wanted value, or negated from the other pool. Recombining is done on the strings, formatted
+# as str() would format the combined expression, so it costs no parsing or truth tables.
+class ExpressionBank:
+    def __init__(self, max_vars: int, max_depth: int, true_exprs: Sequence[str], false_exprs: Sequence[str]) -> None:
+        if not true_exprs or not false_exprs:
+            raise ValueError("Both pools must be nonempty.")
+        # Parameters the expressions were generated with.
+        self.max_vars = max_vars
+        self.max_depth = max_depth
+        self.pools: Dict[BooleanValue, List[str]] = {T: list(true_exprs), F: list(false_exprs)}
+
+    # Generates a bank with size expressions of each value, using exprutility.random_expression().
+    # Every generated expression with an exact value is kept, so the pools hold unbiased samples of its output.
+    @classmethod
+    def generate(cls, max_vars: int, max_depth: int, size: int, rng: Optional[random.Random] = None) -> "ExpressionBank":
+        if size <= 0:
+            raise ValueError("size must be > 0.")
+        pools: Dict[BooleanValue, List[str]] = {T: [], F: []}
+        while len(pools[T]) < size or len(pools[F]) < size:
+            expr = random_expression(max_vars, max_depth, rng)
+            value = exact_value(expr)
+            if value is not None and len(pools[value]) < size:
+                pools[value].append(str(expr))
+        return cls(max_vars, max_depth, pools[T], pools[F])
+
+    def __len__(self) -> int:
+        return len(self.pools[T]) + len(self.pools[F])
+
+    # Draws a random expression string which evaluates to value. With probability recombine, the expression is a
+    # combination of drawn expressions instead of one drawn expression.
+    def draw(self, value: BooleanValue, rng: Optional[random.Random] = None, recombine: float = 0.0) -> str:
+        if rng is None:
+            # The random module's functions, which use its shared generator.
+            rng = random
+        value = from_bool(value)
+        if recombine <= 0 or rng.random() >= recombine:
+            return rng.choice(self.pools[value])
+        choices = operand_combos[value]
+        i = rng.randrange(len(choices) + 1)
+        if i == len(choices):
+            # Formatted as ~(...), which is valid whatever the operand's own syntax.
+            return f"{Negation.symbol}({rng.choice(self.pools[F if value else T])})"
+        operation, lhs_value, rhs_value = choices[i]
+        return f"({rng.choice(self.pools[lhs_value])} {operation.symbol} {rng.choice(self.pools[rhs_value])})"
+
+    # Saves the bank as gzipped text: a header line, then one expression per line prefixed with its value.
+    def save(self, path: str) -> None:
+        with gzip.open(path, mode="wt", encoding="ascii") as file:
+            file.write(f"{bank_magic} {bank_version} {self.max_vars} {self.max_depth}\n")
+            for value in (T, F):
+                for expr in self.pools[value]:
+                    file.write(f"{value} {expr}\n")
+
+    @classmethod
+    def load(cls, path: str) -> "ExpressionBank":
+        pools: Dict[str, List[str]] = {"T": [], "F": []}
+        with gzip.open(path, mode="rt", encoding="ascii") as file:
+            header = file.readline().split()
+            if len(header) != 4 or header[0] != bank_magic:
+                raise BankFormatError("Not an expression bank file.")
+            if header[1] != str(bank_version):
+                raise BankFormatError(f"Unsupported expression bank version {header[1]}.")
+            try:
+                max_vars, max_depth = int(header[2]), int(header[3])
+            except ValueError:
+                raise BankFormatError("Invalid expression bank header.")
+            for line_num, line in enumerate(file, 2):
+                pool = pools.get(line[:1])
+                if pool is None or line[1:2] != " ":
+                    raise BankFormatError(f"Invalid line {line_num}.")
+                pool.append(line[2:].rstrip("\n"))
+        return cls(max_vars, max_depth, pools["T"], pools["F"])
+
+
+# For each value, the binary operations and operand values which give that value, from the operations' join tables.
+def operand_combinations() -> Dict[BooleanValue, List[Tuple[Type[BinaryOperation], BooleanValue, BooleanValue]]]:
+    result: Dict[BooleanValue, List[Tuple[Type[BinaryOperation], BooleanValue, BooleanValue]]] = {T: [], F: []}
+    for operation in binary_operations:
+        for lhs, rhs in product((F, T), repeat=2):
+            result[operation.join[(lhs, rhs)]].append((operation, lhs, rhs))
+    return result
+
+
+operand_combos = operand_combinations()
+
+
+def main(args: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="exprbank.py", description="Generates an expression bank for fileconvert.py.")
+    parser.add_argument("output_path", metavar="output_file")
+    parser.add_argument("--size", type=int, default=10000, help="number of expressions of each value (default: 10000)")
+    parser.add_argument("--max-vars", type=int, default=4, help="(default: 4)")
+    parser.add_argument("--max-depth", type=int, default=5, help="(default: 5)")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible output")
+    args = parser.parse_args(args)
+    if args.size < 1:
+        parser.error("--size must be >= 1.")
+
+    print("Generating...", end="", flush=True)
+    bank = ExpressionBank.generate(args.max_vars, args.max_depth, args.size, random.Random(args.seed))
+    print(" done")
+    try:
+        bank.save(args.output_path)
+    except OSError:
+        print(f'Failed to write output file "{args.output_path}".')
+
+
+if __name__ == "__main__":
+    main()
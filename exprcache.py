@@ -0,0 +1,169 @@
+from boolean import BooleanValue, F, T
+import exprparse
+from lazyeval import exact_value
+from tablefile import input_from_json, input_to_json
+from truthtable import PackedTruthTable, TruthTable
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy
+
+
+__all__ = [
+    "ExpressionCache"
+]
+
+
+# Default maximum number of entries in a cache, beyond which the least recently used are evicted.
+default_max_entries = 1000000
+
+# Number of new or used entries an ExpressionCache holds before writing them to the database.
+flush_size = 1024
+
+# Number of flushes between counts of the entries in the database. Counting scans the whole table, so in between, an
+# ExpressionCache adds the entries it writes to the last count, and only sees other processes' entries when it counts.
+count_interval = 64
+
+# Stored instead of a value for expressions which aren't exact.
+not_exact = "N"
+
+
+# A persistent cache of the results of parsing and evaluating expression strings, in an SQLite database in a
+# directory. Entries are keyed by a hash of the expression text with whitespace normalized, and store the expression's
+# exact value and optionally its truth table's output column.
+# The database is in WAL mode and waits for locks, so any number of processes can use the same directory, each with its
+# own ExpressionCache. Writes, including the last use times used for LRU eviction, are batched, and only reach the
+# database when flush() or close() is called, or enough accumulate.
+class ExpressionCache:
+    file_name = "exprcache.sqlite3"
+
+    def __init__(self, directory: str, max_entries: int = default_max_entries) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1.")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, self.file_name)
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS expressions ("
+                                    "key BLOB PRIMARY KEY, value TEXT NOT NULL, header TEXT, bits BLOB, last_used REAL NOT NULL"
+                                    ") WITHOUT ROWID")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS expressions_last_used ON expressions (last_used)")
+        # Maps keys to (value, header, bits) for entries not yet written.
+        self.pending: Dict[bytes, Tuple[str, Optional[str], Optional[bytes]]] = {}
+        # Maps keys of existing entries to their new last use time.
+        self.used: Dict[bytes, float] = {}
+        self.hits = 0
+        self.misses = 0
+        # The number of entries in the database as of the last count, plus the entries written since, or None before the
+        # first flush.
+        self.count: Optional[int] = None
+        self.flushes_since_count = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        normalized = " ".join(text.split())
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, key: bytes) -> Optional[Tuple[str, Optional[str], Optional[bytes]]]:
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.connection.execute("SELECT value, header, bits FROM expressions WHERE key = ?", (key,)).fetchone()
+            if entry is not None:
+                self.used[key] = time.time()
+        return entry
+
+    def store(self, key: bytes, entry: Tuple[str, Optional[str], Optional[bytes]]) -> None:
+        self.pending[key] = entry
+        if len(self.pending) + len(self.used) >= flush_size:
+            self.flush()
+
+    # Gets the exact value of an expression string, or None if it isn't exact. Raises exprparse.InvalidSyntax for
+    # invalid expressions, which aren't cached.
+    def exact_value(self, text: str) -> Optional[BooleanValue]:
+        key = self.key(text)
+        entry = self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            value = entry[0]
+        else:
+            self.misses += 1
+            expr = exprparse.parse(text)
+            result = None if expr is None else exact_value(expr)
+            value = not_exact if result is None else str(result)
+            self.store(key, (value, None, None))
+        return None if value == not_exact else (T if value == str(T) else F)
+
+    # Gets the truth table of an expression string. Raises exprparse.InvalidSyntax for invalid expressions, and
+    # ValueError for empty ones.
+    def truth(self, text: str) -> TruthTable:
+        key = self.key(text)
+        entry = self.lookup(key)
+        if entry is not None and entry[2] is not None:
+            self.hits += 1
+            _, header, bits = entry
+            header = json.loads(header)
+            inputs = [input_from_json(i) for i in header["inputs"]]
+            return PackedTruthTable(inputs, numpy.frombuffer(bits, dtype="<u8").astype(numpy.uint64), header["name"])
+        self.misses += 1
+        expr = exprparse.parse(text)
+        if expr is None:
+            raise ValueError("Expression is empty.")
+        table = expr.truth
+        packed = table if isinstance(table, PackedTruthTable) else PackedTruthTable.from_table(table)
+        outputs = table.outputs
+        value = str(next(iter(outputs))) if len(outputs) == 1 else not_exact
+        header = json.dumps({"name": table.name, "inputs": [input_to_json(i) for i in table.inputs]})
+        self.store(key, (value, header, numpy.asarray(packed.bits, dtype="<u8").tobytes()))
+        return table
+
+    # Writes pending entries and use times to the database, then evicts the least recently used entries beyond
+    # max_entries. Entries are only counted every count_interval flushes, so the database may briefly hold more than
+    # max_entries while other processes write to it.
+    def flush(self) -> None:
+        if not self.pending and not self.used:
+            return
+        now = time.time()
+        with self.connection:
+            if self.count is None or self.flushes_since_count >= count_interval:
+                self.count = self.connection.execute("SELECT count(*) FROM expressions").fetchone()[0]
+                self.flushes_since_count = 0
+            self.flushes_since_count += 1
+            # Looking up each key is cheap, unlike counting the table.
+            self.count += sum(self.connection.execute("SELECT 1 FROM expressions WHERE key = ?", (key,)).fetchone() is None
+                              for key in self.pending)
+            self.connection.executemany(
+                "INSERT INTO expressions (key, value, header, bits, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, header = coalesce(excluded.header, header), "
+                "bits = coalesce(excluded.bits, bits), last_used = excluded.last_used",
+                ((key, value, header, bits, now) for key, (value, header, bits) in self.pending.items()))
+            self.connection.executemany("UPDATE expressions SET last_used = max(last_used, ?) WHERE key = ?",
+                                        ((last_used, key) for key, last_used in self.used.items()))
+            if self.count > self.max_entries:
+                cursor = self.connection.execute("DELETE FROM expressions WHERE key IN "
+                                                 "(SELECT key FROM expressions ORDER BY last_used LIMIT ?)", (self.count - self.max_entries,))
+                self.count -= cursor.rowcount
+        self.pending.clear()
+        self.used.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self) -> "ExpressionCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,29 +1,118 @@
 from boolean import BooleanValue, F, T
-from truthtable import Input, TruthTable
+from truthtable import Input, PackedTruthTable, TruthTable
 from utility import cached_property
 
-from typing import Any, FrozenSet
+from collections import deque
+from typing import Any, Callable, Deque, Dict, FrozenSet, Hashable, Iterator, List, Optional, Sequence, Tuple, Union
+from weakref import WeakValueDictionary
 
 
 __all__ = [
     "CompoundExpression",
     "Expression",
+    "InternedType",
+    "join_parts",
+    "lazy_str",
     "Literal",
     "literal_f",
     "literal_t",
+    "postorder",
+    "precompute_truth",
+    "retain_expressions",
     "SimpleExpression",
+    "truth_inputs",
+    "TruthTableEngine",
     "Variable"
 ]
 
 
-class Expression:
+# Maps (class, *structure) to the canonical expression with that structure. The key is one flat tuple, since there is
+# one entry per distinct expression.
+interned_expressions: "WeakValueDictionary[Tuple[Hashable, ...], Expression]" = WeakValueDictionary()
+
+# Strong references to the most recently used expressions, so that common subexpressions (and their cached truth tables)
+# outlive the expression they were parsed in.
+recent_expressions: "Deque[Expression]" = deque(maxlen=4096)
+
+
+# Metaclass which hash-conses expressions: constructing an expression returns the existing expression with the same
+# class and structure if there is one, so equal subexpressions are shared and compute their truth table only once.
+class InternedType(type):
+    def __call__(cls, *args, **kwargs) -> "Expression":
+        key = (cls,) + cls.interning_key(*args, **kwargs)
+        expr = interned_expressions.get(key)
+        if expr is None:
+            expr = super().__call__(*args, **kwargs)
+            expr._hash = hash(key)
+            interned_expressions[key] = expr
+        recent_expressions.append(expr)
+        return expr
+
+
+# Sets how many recently used expressions are kept alive by the interning table.
+def retain_expressions(count: int) -> None:
+    global recent_expressions
+    if count < 0:
+        raise ValueError("count must be >= 0.")
+    recent_expressions = deque(recent_expressions, maxlen=count)
+
+
+# Answers questions about expressions by computing their full truth table.
+# Other engines subclass this and override what they can do more efficiently. The engine used by all expressions is
+# selected by setting Expression.engine.
+class TruthTableEngine:
+    def values(self, expr: "Expression") -> FrozenSet[BooleanValue]:
+        return expr.truth.outputs
+
+    def probability(self, expr: "Expression", value: BooleanValue) -> float:
+        return expr.truth.distribution[value]
+
+    # Counts the assignments of the expression's variables for which it evaluates to value.
+    def count(self, expr: "Expression", value: BooleanValue) -> int:
+        return expr.truth.count(value)
+
+    # Finds an assignment of the expression's variables, by name, for which it evaluates to value.
+    # Returns None if there is no such assignment.
+    def find_assignment(self, expr: "Expression", value: BooleanValue) -> Optional[Dict[str, BooleanValue]]:
+        table = expr.truth
+        for inputs, output in table.items():
+            if output == value:
+                return {i.tag.name: v for i, v in zip(table.inputs, inputs) if isinstance(i.tag, Variable)}
+        return None
+
+
+class Expression(metaclass=InternedType):
+    # Every subclass declares __slots__, so expressions have no __dict__. _truth holds the cached truth table.
+    __slots__ = ("_hash", "_truth", "__weakref__")
+
+    engine: TruthTableEngine = TruthTableEngine()
+
+    # Gives the structure of an expression constructed with the given arguments. Must match the structure property.
+    @staticmethod
+    def interning_key(*args, **kwargs) -> Tuple[Hashable, ...]:
+        return args + tuple(sorted(kwargs.items()))
+
+    # The values which identify this expression among expressions of the same class.
+    @property
+    def structure(self) -> Tuple[Hashable, ...]:
+        return ()
+
+    @property
+    def operands(self) -> Tuple["Expression", ...]:
+        return ()
+
     @cached_property
     def truth(self) -> TruthTable:
         return None
 
+    # The distinct variables in the expression, in order of first occurrence.
+    @property
+    def variables(self) -> Tuple["Variable", ...]:
+        return tuple(node for node in postorder(self) if isinstance(node, Variable))
+
     @property
     def values(self) -> FrozenSet[BooleanValue]:
-        return self.truth.outputs
+        return self.engine.values(self)
 
     @property
     def is_exact(self) -> bool:
@@ -47,38 +136,74 @@ class Expression:
         return value in self.values
 
     def probability(self, value: BooleanValue) -> float:
-        return self.truth.distribution[value]
+        return self.engine.probability(self, value)
+
+    def count(self, value: BooleanValue) -> int:
+        return self.engine.count(self, value)
+
+    def find_assignment(self, value: BooleanValue) -> Optional[Dict[str, BooleanValue]]:
+        return self.engine.find_assignment(self, value)
+
+    # The pieces of str(self). Expressions among them are replaced with their own str parts.
+    def str_parts(self) -> Sequence[Union[str, "Expression"]]:
+        return object.__str__(self),
+
+    # The pieces of repr(self). Expressions among them are replaced with their own repr parts.
+    def repr_parts(self) -> Sequence[Union[str, "Expression"]]:
+        return object.__repr__(self),
+
+    def __str__(self) -> str:
+        return join_parts(self, lambda expr: expr.str_parts())
+
+    def __repr__(self) -> str:
+        return join_parts(self, lambda expr: expr.repr_parts())
+
+    def __eq__(self, other: Any) -> bool:
+        return self is other or (type(self) is type(other) and self.structure == other.structure)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self) -> Tuple[type, Tuple[Hashable, ...]]:
+        return type(self), self.structure
 
 
 class SimpleExpression(Expression):
-    pass
+    __slots__ = ()
 
 
 class CompoundExpression(Expression):
-    pass
+    __slots__ = ()
 
 
 class Literal(SimpleExpression):
+    __slots__ = ("value",)
+
     def __init__(self, value: BooleanValue) -> None:
         self.value = value
 
+    @staticmethod
+    def interning_key(value: BooleanValue) -> Tuple[Hashable, ...]:
+        return value,
+
+    @property
+    def structure(self) -> Tuple[Hashable, ...]:
+        return self.value,
+
     @cached_property
     def truth(self) -> TruthTable:
-        return TruthTable((Input(self.value, {self.value}),), {
-            (self.value,): self.value
-        }, str(self))
+        return PackedTruthTable.from_column((Input(self.value, {self.value}),), (self.value,), str(self))
 
-    def __eq__(self, other: Any) -> bool:
-        return isinstance(other, Literal) and self.value == other.value
-
-    def __str__(self) -> str:
-        return str(self.value)
+    def str_parts(self) -> Sequence[Union[str, Expression]]:
+        return str(self.value),
 
-    def __repr__(self) -> str:
-        return f"Literal(value={repr(self.value)})"
+    def repr_parts(self) -> Sequence[Union[str, Expression]]:
+        return f"Literal(value={repr(self.value)})",
 
 
 class Variable(SimpleExpression):
+    __slots__ = ("name",)
+
     def __init__(self, name: str) -> None:
         if len(name) == 0:
             raise ValueError("name must not be empty.")
@@ -86,22 +211,81 @@ class Variable(SimpleExpression):
             raise ValueError("name must contain only letters.")
         self.name = name
 
+    @staticmethod
+    def interning_key(name: str) -> Tuple[Hashable, ...]:
+        return name,
+
+    @property
+    def structure(self) -> Tuple[Hashable, ...]:
+        return self.name,
+
     @cached_property
     def truth(self) -> TruthTable:
-        return TruthTable((Input(self),), {
-            (F,): F,
-            (T,): T
-        }, str(self))
-
-    def __eq__(self, other: Any) -> bool:
-        return isinstance(other, Variable) and self.name == other.name
+        return PackedTruthTable.from_column((Input(self),), (F, T), str(self))
 
-    def __str__(self) -> str:
-        return self.name
+    def str_parts(self) -> Sequence[Union[str, Expression]]:
+        return self.name,
 
-    def __repr__(self) -> str:
-        return f"Variable(name={self.name})"
+    def repr_parts(self) -> Sequence[Union[str, Expression]]:
+        return f"Variable(name={self.name})",
 
 
 literal_f = Literal(F)
 literal_t = Literal(T)
+
+
+# Iterates over the distinct subexpressions of expr (including expr itself), each one after its operands.
+# Uses an explicit stack, so works regardless of the depth of the expression.
+def postorder(expr: Expression) -> Iterator[Expression]:
+    visited = set()
+    stack = [(expr, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+        elif node not in visited:
+            visited.add(node)
+            stack.append((node, True))
+            for operand in reversed(node.operands):
+                if operand not in visited:
+                    stack.append((operand, False))
+
+
+# Builds a string from the parts of expr, where parts which are expressions are expanded into their own parts.
+# Uses an explicit stack, so works regardless of the depth of the expression.
+def join_parts(expr: Expression, parts: Callable[[Expression], Sequence[Union[str, Expression]]]) -> str:
+    pieces: List[str] = []
+    stack: List[Union[str, Expression]] = [expr]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+        else:
+            stack.extend(reversed(parts(item)))
+    return "".join(pieces)
+
+
+# Gets a function which computes str(expr) when called, for naming expr's truth table lazily. It refers to expr's
+# operands but not expr itself, so the truth table cached on expr doesn't form a reference cycle with it, and
+# expressions are freed as soon as they are unused rather than by the garbage collector, one level per collection.
+def lazy_str(expr: Expression) -> Callable[[], str]:
+    parts = tuple(expr.str_parts())
+    return lambda: "".join(part if isinstance(part, str) else str(part) for part in parts)
+
+
+# Computes the truth tables of expr and its subexpressions which don't have them yet, operands first, so that no
+# truth table computation has to recurse into its operands.
+def precompute_truth(expr: Expression) -> None:
+    stack = [(expr, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            node.truth
+        elif not type(node).truth.is_cached(node):
+            stack.append((node, True))
+            stack.extend((operand, False) for operand in reversed(node.operands))
+
+
+# The inputs of expr's truth table, without computing it: each variable and literal value, in order of first occurrence.
+def truth_inputs(expr: Expression) -> Tuple[Input, ...]:
+    return tuple(node.truth.inputs[0] for node in postorder(expr) if isinstance(node, SimpleExpression))
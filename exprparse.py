@@ -1,28 +1,38 @@
 import boolean
 import expression
+import flatexpr
 import operation
+import stats
+from utility import ordered_map
 
 from abc import ABC, abstractmethod
+from itertools import islice
+from multiprocessing import Pool
+import os
 import re
-from typing import List, Sequence, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 
 __all__ = [
     "InvalidSyntax",
-    "parse"
+    "parse",
+    "parse_flat",
+    "parse_many"
 ]
 
 
+# A token of source[start_pos:end_pos]. Tokens only keep their offsets, and whatever their class needs from the text,
+# so that they don't hold on to the source string.
 class Token(ABC):
+    __slots__ = ("start_pos", "end_pos")
+
     def __init__(self, source: str, start_pos: int, end_pos: int) -> None:
         if start_pos < 0:
             raise ValueError("start_pos must be >= 0.")
         if end_pos < start_pos:
             raise ValueError("start_pos must be <= end_pos.")
-        self.source = source
         self.start_pos = start_pos
         self.end_pos = end_pos
-        self.string = source[start_pos:end_pos]
 
     @property
     @abstractmethod
@@ -30,22 +40,28 @@ class Token(ABC):
         pass
 
     def __repr__(self) -> str:
-        return self.string
+        return f"{self.__class__.__name__}({self.start_pos}, {self.end_pos})"
 
 
 class StartOfTokens(Token):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "start of string"
 
 
 class EndOfTokens(Token):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "end of string"
 
 
 class SimpleExpression(Token, ABC):
+    __slots__ = ()
+
     @property
     @abstractmethod
     def expr(self) -> expression.SimpleExpression:
@@ -53,9 +69,11 @@ class SimpleExpression(Token, ABC):
 
 
 class BooleanLiteral(SimpleExpression):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self._expr = expression.Literal(str_to_boolean(self.string))
+    __slots__ = ("_expr",)
+
+    def __init__(self, source: str, start_pos: int, end_pos: int) -> None:
+        super().__init__(source, start_pos, end_pos)
+        self._expr = expression.Literal(str_to_boolean(source[start_pos:end_pos]))
 
     @property
     def description(self) -> str:
@@ -67,9 +85,11 @@ class BooleanLiteral(SimpleExpression):
 
 
 class Variable(SimpleExpression):
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self._expr = expression.Variable(self.string)
+    __slots__ = ("_expr",)
+
+    def __init__(self, source: str, start_pos: int, end_pos: int) -> None:
+        super().__init__(source, start_pos, end_pos)
+        self._expr = expression.Variable(source[start_pos:end_pos])
 
     @property
     def description(self) -> str:
@@ -81,43 +101,60 @@ class Variable(SimpleExpression):
 
 
 class Operator(Token, ABC):
-    pass
+    __slots__ = ("info",)
+
+    def __init__(self, source: str, start_pos: int, end_pos: int) -> None:
+        super().__init__(source, start_pos, end_pos)
+        self.info: OperatorInfo = operator_info[source[start_pos:end_pos]]
 
 
 class UnaryOperator(Operator):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "unary operator"
 
 
 class BinaryOperator(Operator):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "binary operator"
 
 
 class OpenParenthesis(Token):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "opening parenthesis"
 
 
 class CloseParenthesis(Token):
+    __slots__ = ()
+
     @property
     def description(self) -> str:
         return "closing parenthesis"
 
 
 class OperatorInfo:
+    __slots__ = ("precedence", "cls")
+
     def __init__(self, precedence: int, cls: type) -> None:
         self.precedence = precedence
         self.cls = cls
 
 
 class InvalidSyntax(ValueError):
-    def __init__(self, pos: int, message: str):
+    def __init__(self, pos: int, message: str, index: Optional[int] = None):
+        super().__init__(pos, message, index)
         self.pos = pos
         self.message = message
+        # Position of the expression in the input of parse_many().
+        self.index = index
 
     def __str__(self):
         return f"At position {self.pos}: {self.message}"
@@ -134,6 +171,12 @@ token_regexes = [
 ]
 
 
+# token_regexes combined into one regex, with a named group per token class, plus whitespace. Alternatives are tried in
+# order, so tokenizing this way matches the same token as trying each regex in turn.
+token_master_regex = re.compile("|".join(f"(?P<token{i}>{regex})" for i, (regex, _) in enumerate(token_regexes)) + r"|(?P<space>\s+)")
+token_group_classes = {f"token{i}": cls for i, (_, cls) in enumerate(token_regexes)}
+
+
 # A sequence of 2 consecutive tokens must be one of these to be valid.
 valid_sequences = (
     (StartOfTokens, EndOfTokens),
@@ -169,36 +212,96 @@ operator_info = {
 }
 
 
+@stats.timed("exprparse.parse")
 def parse(expr: str) -> Union[expression.Expression, None]:
+    if stats.enabled:
+        stats.increment("exprparse.characters", len(expr))
     tokens = parse_tokens(expr)
     check_syntax(tokens)
-    postfix = infix_to_postfix(tokens)
-    result = evaluate_postfix(postfix)
+    result = build_expression(tokens)
     return result
 
 
+# Like parse(), but builds a flatexpr.FlatExpression directly, without creating an expression object per node.
+def parse_flat(expr: str) -> Union[flatexpr.FlatExpression, None]:
+    tokens = parse_tokens(expr)
+    check_syntax(tokens)
+    builder = flatexpr.FlatExpressionBuilder()
+    root = build_expression(tokens, lambda token: builder.simple(token.expr), builder.operation)
+    if root is None:
+        return None
+    return builder.finish()
+
+
+# Parses many expressions in a pool of worker processes, yielding the results in input order as they become available.
+# An expression with invalid syntax yields its InvalidSyntax error, with index set, instead of raising it.
+# Expressions are sent to the workers in chunks of chunksize, to spread the per-task overhead, and only a few chunks
+# are read ahead of the results consumed. Workers send back flatexpr.FlatExpressions, which unlike expression trees
+# can be pickled whatever their depth. workers defaults to the number of CPUs, and 1 parses in this process.
+def parse_many(exprs: Iterable[str], workers: Optional[int] = None, chunksize: int = 256) -> Iterator[Union[expression.Expression, None, InvalidSyntax]]:
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be >= 1.")
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1.")
+
+    exprs = iter(exprs)
+    chunks = iter(lambda: list(islice(exprs, chunksize)), [])
+    indexed_chunks = ((i * chunksize, chunk) for i, chunk in enumerate(chunks))
+    if workers == 1:
+        for chunk in indexed_chunks:
+            yield from parse_chunk(chunk)
+    else:
+        with Pool(workers) as pool:
+            for results in ordered_map(pool, parse_flat_chunk, indexed_chunks, 2 * (workers or os.cpu_count() or 1)):
+                for result in results:
+                    if isinstance(result, flatexpr.FlatExpression):
+                        yield result.to_expression()
+                    elif isinstance(result, InvalidSyntax) or result is None:
+                        yield result
+                    else:
+                        raise result
+
+
+def parse_chunk(chunk: Tuple[int, List[str]]) -> List[Union[expression.Expression, None, InvalidSyntax]]:
+    start_index, exprs = chunk
+    results: List[Union[expression.Expression, None, InvalidSyntax]] = []
+    for index, expr in enumerate(exprs, start_index):
+        try:
+            results.append(parse(expr))
+        except InvalidSyntax as e:
+            results.append(InvalidSyntax(e.pos, e.message, index))
+    return results
+
+
+# Like parse_chunk(), but parses to flatexpr.FlatExpressions. Any other error is returned in place of its expression
+# too, so that one failure doesn't lose the rest of the chunk.
+def parse_flat_chunk(chunk: Tuple[int, List[str]]) -> List[Union[flatexpr.FlatExpression, None, Exception]]:
+    start_index, exprs = chunk
+    results: List[Union[flatexpr.FlatExpression, None, Exception]] = []
+    for index, expr in enumerate(exprs, start_index):
+        try:
+            results.append(parse_flat(expr))
+        except InvalidSyntax as e:
+            results.append(InvalidSyntax(e.pos, e.message, index))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+@stats.timed("exprparse.parse_tokens")
 def parse_tokens(expr: str) -> List[Token]:
     tokens: List[Token] = [StartOfTokens(expr, 0, 0)]
+    match = token_master_regex.match
     i = 0
     while i < len(expr):
-        if expr[i].isspace():
-            i += 1
-        else:
-            matched = False
-            j = 0
-            while not matched and j < len(token_regexes):
-                regex, cls = token_regexes[j]
-                match = re.match(regex, expr[i:])
-                if match:
-                    start_pos = i + match.start()
-                    end_pos = i + match.end()
-                    token = cls(expr, start_pos, end_pos)
-                    tokens.append(token)
-                    matched = True
-                    i = end_pos
-                j += 1
-            if not matched:
-                raise InvalidSyntax(i, "Invalid token.")
+        m = match(expr, i)
+        if m is None:
+            raise InvalidSyntax(i, "Invalid token.")
+        end_pos = m.end()
+        cls = token_group_classes.get(m.lastgroup)
+        if cls is not None:
+            tokens.append(cls(expr, i, end_pos))
+        i = end_pos
     tokens.append(EndOfTokens(expr, len(expr), len(expr)))
     return tokens
 
@@ -212,6 +315,7 @@ def str_to_boolean(s: str) -> boolean.BooleanValue:
         raise AssertionError(f"Didn't expect string \"{s}\".")
 
 
+@stats.timed("exprparse.check_syntax")
 def check_syntax(tokens: Sequence[Token]) -> None:
     assert len(tokens) >= 2
     prev_token = tokens[0]
@@ -260,28 +364,102 @@ def infix_to_postfix(tokens: Sequence[Token]) -> List[Token]:
     return postfix
 
 
+# Builds the expression from syntactically valid tokens by operator precedence. Equivalent to
+# evaluate_postfix(infix_to_postfix(tokens)), but applies operators as soon as they are popped instead of building the
+# postfix list first.
+# make_simple and make_operation build the nodes, by default as expression objects. make_operation is called with an
+# operation class and the already built operands.
+@stats.timed("exprparse.build_expression")
+def build_expression(tokens: Sequence[Token], make_simple: Callable[[SimpleExpression], Any] = None,
+                     make_operation: Callable[..., Any] = None) -> Any:
+    if make_simple is None:
+        make_simple = simple_expression
+    if make_operation is None:
+        make_operation = apply_operation
+    operands: List[Any] = []
+    operators: List[Union[Operator, OpenParenthesis]] = []
+
+    def apply(op: Operator) -> None:
+        if isinstance(op, UnaryOperator):
+            assert len(operands) >= 1
+            operands.append(make_operation(op.info.cls, operands.pop()))
+        else:
+            assert len(operands) >= 2
+            rhs = operands.pop()
+            lhs = operands.pop()
+            operands.append(make_operation(op.info.cls, lhs, rhs))
+
+    assert len(tokens) >= 2
+    for token in tokens[1:-1]:
+        if isinstance(token, OpenParenthesis):
+            operators.append(token)
+
+        elif isinstance(token, CloseParenthesis):
+            try:
+                while not isinstance(operators[-1], OpenParenthesis):
+                    apply(operators.pop())
+            except IndexError:
+                raise InvalidSyntax(token.start_pos, "Unmatched closing parenthesis.")
+            operators.pop()
+
+        elif isinstance(token, UnaryOperator):
+            operators.append(token)
+
+        elif isinstance(token, BinaryOperator):
+            while operators and not isinstance(operators[-1], OpenParenthesis) and operator_precedence(operators[-1]) >= operator_precedence(token):
+                apply(operators.pop())
+            operators.append(token)
+
+        elif isinstance(token, SimpleExpression):
+            operands.append(make_simple(token))
+
+        else:
+            raise AssertionError(f"Didn't expect type `{type(token)}`.")
+
+    while operators:
+        token = operators.pop()
+        if isinstance(token, OpenParenthesis):
+            raise InvalidSyntax(token.start_pos, "Unmatched opening parenthesis.")
+        apply(token)
+
+    if not operands:
+        return None
+    assert len(operands) == 1
+    return operands.pop()
+
+
+# Caches is_token_allowed() by token class, since valid_sequences only depends on the classes.
+allowed_sequence_cache: Dict[Tuple[type, type], bool] = {}
+
+
 # Checks if the occurrence of token directly after prev_token is valid.
 def is_token_allowed(prev_token: Token, token: Token) -> bool:
-    # Set of token types that are allowed to occur after the previous token.
-    allowed = map(lambda t: t[1],
-                  filter(lambda t: isinstance(prev_token, t[0]),
-                      valid_sequences))
-    return any(map(lambda cls: isinstance(token, cls), allowed))
+    key = (type(prev_token), type(token))
+    allowed = allowed_sequence_cache.get(key)
+    if allowed is None:
+        allowed = any(isinstance(prev_token, prev_cls) and isinstance(token, cls) for prev_cls, cls in valid_sequences)
+        allowed_sequence_cache[key] = allowed
+    return allowed
+
+
+def simple_expression(token: SimpleExpression) -> expression.SimpleExpression:
+    return token.expr
+
+
+def apply_operation(cls: type, *operands: expression.Expression) -> expression.Expression:
+    return cls(*operands)
 
 
 def operator_precedence(token: Operator) -> int:
-    assert token.string in operator_info
-    return operator_info[token.string].precedence
+    return token.info.precedence
 
 
 def evaluate_unary_operator(op: Operator, arg: expression.Expression) -> expression.Expression:
-    assert op.string in operator_info
-    return operator_info[op.string].cls(arg)
+    return op.info.cls(arg)
 
 
 def evaluate_binary_operator(op: Operator, lhs: expression.Expression, rhs: expression.Expression) -> expression.Expression:
-    assert op.string in operator_info
-    return operator_info[op.string].cls(lhs, rhs)
+    return op.info.cls(lhs, rhs)
 
 
 def evaluate_postfix(postfix: List[Token]) -> Union[expression.Expression, None]:
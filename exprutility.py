@@ -1,8 +1,11 @@
-from boolean import BooleanValue
+from boolean import BooleanValue, F, from_bool, T
 from expression import Expression, literal_f, literal_t, Variable
-from operation import binary_operations, unary_operations
+from operation import binary_operations, Negation, Operation, unary_operations
+import stats
 
+from itertools import product
 import random
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 
 __all__ = [
@@ -11,36 +14,158 @@ __all__ = [
 ]
 
 
-def random_expression(max_vars: int, max_depth: int) -> Expression:
+# rng is the random number generator to use, by default the random module's.
+def random_expression(max_vars: int, max_depth: int, rng: Optional[random.Random] = None) -> Expression:
+    return generate_expression(max_vars, max_depth, None, rng)
+
+
+# Generates a random expression which evaluates to value, in a single pass.
+def random_expression_with_value(max_vars: int, max_depth: int, value: BooleanValue, rng: Optional[random.Random] = None) -> Expression:
+    return generate_expression(max_vars, max_depth, from_bool(value), rng)
+
+
+# Generates a random expression, which evaluates to value if value isn't None.
+# The tree is built top down, and each node gets a target value, or None if its value doesn't matter. A node with a
+# target is a literal with that value, a variable paired with itself, or an operation with one of the operand patterns
+# which give that value (see make_operand_patterns()). Subtrees without a target are generated as by
+# random_expression().
+@stats.timed("exprutility.generate_expression")
+def generate_expression(max_vars: int, max_depth: int, value: Optional[BooleanValue], rng: Optional[random.Random]) -> Expression:
+    if rng is None:
+        # The random module's functions, which use its shared generator.
+        rng = random
     if not 0 <= max_vars <= 26:
         raise ValueError("max_vars must be >= 0 and <= 26.")
     if max_depth <= 0:
         raise ValueError("max_depth must be > 0.")
 
-    variables = random.choices([Variable(c) for c in "abcdefghijklmnopqrstuvwxyz"], k=max_vars)
+    variables = rng.choices([Variable(c) for c in "abcdefghijklmnopqrstuvwxyz"], k=max_vars)
     literals = [literal_f, literal_t]
 
-    def _random_expression(depth=0):
-        r = random.randint(1, 100)
+    # Generates the tree top down with an explicit stack, drawing random numbers in the same order as a recursive
+    # generator would. Each task is one of:
+    #  - ("generate", depth, target)
+    #  - ("build", operation, arity), which replaces the last arity generated expressions with the operation applied to
+    #    them.
+    #  - ("build_pair", operation, negate_lhs, negate_rhs), which replaces the last generated expression with the
+    #    operation applied to it twice, negating each operand if specified.
+    tasks: List[Tuple[Any, ...]] = [("generate", 0, value)]
+    exprs: List[Expression] = []
+    # Numbers of nodes generated, nodes with a target value, and variables paired with themselves to get a value.
+    num_nodes = num_targeted = num_pairs = 0
+    while tasks:
+        task = tasks.pop()
+        if task[0] == "build":
+            _, operation, arity = task
+            operands = exprs[len(exprs) - arity:]
+            del exprs[len(exprs) - arity:]
+            exprs.append(operation(*operands))
+            continue
+        elif task[0] == "build_pair":
+            _, operation, negate_lhs, negate_rhs = task
+            operand = exprs.pop()
+            exprs.append(operation(Negation(operand) if negate_lhs else operand, Negation(operand) if negate_rhs else operand))
+            continue
+
+        _, depth, target = task
+        num_nodes += 1
+        if target is not None:
+            num_targeted += 1
+        r = rng.randint(1, 100)
         simple_cutoff = round((depth / max_depth) * 100)
         if r <= simple_cutoff:
-            if max_vars == 0 or random.randint(0, 1) == 0:
-                return random.choice(literals)
+            if target is not None:
+                if max_vars == 0 or depth == max_depth or rng.randint(0, 1) == 0:
+                    exprs.append(literal_t if target else literal_f)
+                else:
+                    # A variable can't have a value by itself, so pair it with itself, as in (a -> a), using a
+                    # negation only if there's room for it below max_depth.
+                    num_pairs += 1
+                    patterns = pair_patterns if depth + 2 <= max_depth else unnegated_pair_patterns
+                    operation, negate_lhs, negate_rhs = rng.choice(patterns[target])
+                    var = rng.choice(variables)
+                    exprs.append(operation(Negation(var) if negate_lhs else var, Negation(var) if negate_rhs else var))
+            elif max_vars == 0 or rng.randint(0, 1) == 0:
+                exprs.append(rng.choice(literals))
             else:
-                return random.choice(variables)
+                exprs.append(rng.choice(variables))
         elif r <= simple_cutoff + ((100 - simple_cutoff) / 3):
-            return random.choice(unary_operations)(_random_expression(depth + 1))
+            operation = rng.choice(unary_operations)
+            tasks.append(("build", operation, 1))
+            if target is None:
+                tasks.append(("generate", depth + 1, None))
+            else:
+                _, operand_target = rng.choice(operand_patterns[operation][target])
+                tasks.append(("generate", depth + 1, operand_target))
         else:
-            return random.choice(binary_operations)(_random_expression(depth + 1), _random_expression(depth + 1))
+            operation = rng.choice(binary_operations)
+            if target is None:
+                tasks.append(("build", operation, 2))
+                tasks.append(("generate", depth + 1, None))
+                tasks.append(("generate", depth + 1, None))
+                continue
+            patterns = operand_patterns if depth + 2 <= max_depth else unnegated_operand_patterns
+            pattern = rng.choice(patterns[operation][target])
+            if pattern[0] == "values":
+                _, lhs_target, rhs_target = pattern
+                tasks.append(("build", operation, 2))
+                tasks.append(("generate", depth + 1, rhs_target))
+                tasks.append(("generate", depth + 1, lhs_target))
+            else:
+                _, negate_lhs, negate_rhs = pattern
+                tasks.append(("build_pair", operation, negate_lhs, negate_rhs))
+                # A negated operand is a level further down.
+                tasks.append(("generate", depth + 2 if negate_lhs or negate_rhs else depth + 1, None))
+
+    assert len(exprs) == 1
+    if stats.enabled:
+        stats.increment("exprutility.nodes", num_nodes)
+        stats.increment("exprutility.targeted_nodes", num_targeted)
+        stats.increment("exprutility.variable_pairs", num_pairs)
+    return exprs[0]
+
+
+# For each operation and value, the ways of choosing operands which make the operation evaluate to that value, from
+# the operation's join table. Each is either:
+#  - ("values", operand targets...), where a target of None means any operand will do, e.g. (T | anything).
+#  - ("pair", negate_lhs, negate_rhs), for binary operations applied to one operand, or to it and its negation, e.g.
+#    (x <-> x) or (x & ~x).
+def make_operand_patterns() -> Dict[Type[Operation], Dict[BooleanValue, List[Tuple[Any, ...]]]]:
+    result: Dict[Type[Operation], Dict[BooleanValue, List[Tuple[Any, ...]]]] = {}
+    for operation in unary_operations + binary_operations:
+        patterns: Dict[BooleanValue, List[Tuple[Any, ...]]] = {F: [], T: []}
+        arity = len(operation.join.inputs)
+        for row in product((F, T), repeat=arity):
+            patterns[operation.join[row]].append(("values",) + row)
+        for i in range(arity):
+            # Rows which give the same value whatever operand i is.
+            for row in product((F, T), repeat=arity - 1):
+                values = {operation.join[row[:i] + (operand,) + row[i:]] for operand in (F, T)}
+                if len(values) == 1:
+                    patterns[values.pop()].append(("values",) + row[:i] + (None,) + row[i:])
+        if arity == 2:
+            for negate_lhs, negate_rhs in ((False, False), (False, True), (True, False)):
+                values = {operation.join[(from_bool(operand.value != negate_lhs), from_bool(operand.value != negate_rhs))] for operand in (F, T)}
+                if len(values) == 1:
+                    patterns[values.pop()].append(("pair", negate_lhs, negate_rhs))
+        result[operation] = patterns
+    return result
+
 
-    return _random_expression()
+operand_patterns = make_operand_patterns()
 
+# For each value, the binary operations and negations of their "pair" patterns which give that value.
+pair_patterns: Dict[BooleanValue, List[Tuple[Type[Operation], bool, bool]]] = {
+    value: [(operation,) + pattern[1:] for operation in binary_operations for pattern in operand_patterns[operation][value] if pattern[0] == "pair"]
+    for value in (F, T)
+}
 
-def random_expression_with_value(max_vars: int, max_depth: int, value: BooleanValue) -> Expression:
-    while True:
-        expr = random_expression(max_vars, max_depth)
-        try:
-            if expr.exact_value == value:
-                return expr
-        except ValueError:
-            pass
+# The patterns above without any negated "pair" patterns, for nodes too close to max_depth for a negation below them.
+unnegated_operand_patterns: Dict[Type[Operation], Dict[BooleanValue, List[Tuple[Any, ...]]]] = {
+    operation: {value: [pattern for pattern in value_patterns if pattern[0] != "pair" or not any(pattern[1:])]
+                for value, value_patterns in patterns.items()}
+    for operation, patterns in operand_patterns.items()
+}
+unnegated_pair_patterns: Dict[BooleanValue, List[Tuple[Type[Operation], bool, bool]]] = {
+    value: [pattern for pattern in patterns if not any(pattern[1:])] for value, patterns in pair_patterns.items()
+}
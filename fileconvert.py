@@ -1,11 +1,28 @@
 import boolean
+from exprbank import BankFormatError, ExpressionBank
+from exprcache import ExpressionCache
 import exprparse
 import exprutility
+import lazyeval
+import stats
+from utility import ordered_map
 
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
 from contextlib import ExitStack
-from io import TextIOBase
+import io
+from itertools import islice
+from multiprocessing import Pool
+import os
+import random
+import sqlite3
+import stat
 import sys
-from typing import Iterator, List
+import threading
+from typing import (Any, AsyncIterable, AsyncIterator, BinaryIO, Callable, Deque, Dict, IO, Iterable, Iterator, List,
+                    Optional, Sequence, TextIO, Tuple, Union)
 
 import numpy
 from tqdm import tqdm
@@ -13,6 +30,7 @@ from tqdm import tqdm
 
 class DecodeError(Exception):
     def __init__(self, line_num: int, message: str) -> None:
+        super().__init__(line_num, message)
         self.line_num = line_num
         self.message = message
 
@@ -20,6 +38,40 @@ class DecodeError(Exception):
         return f"Error on line {self.line_num}:\n{self.message}"
 
 
+class BitCountError(Exception):
+    def __str__(self) -> str:
+        return "Number of input bits is not a multiple of 8."
+
+
+class ReadError(Exception):
+    pass
+
+
+# Approximate number of characters of input read at a time when decoding.
+read_chunk_size = 1 << 20
+
+# Number of decoded bytes buffered before they are written to the output.
+write_buffer_size = 1 << 16
+
+# Number of bytes' worth of lines decoded by each task when decoding with multiple jobs.
+decode_chunk_bytes = 1024
+
+# Number of input bytes encoded by each task when encoding. Each chunk gets its own random number generator, so
+# output for a given seed doesn't depend on the number of jobs.
+encode_chunk_bytes = 256
+
+# Expression bank encode_chunk() draws from, with the probability of recombining drawn expressions, or None to generate
+# expressions. Set by use_bank(), in each worker process when encoding with multiple jobs.
+encode_bank: Optional[Tuple[ExpressionBank, float]] = None
+
+# Directory of the expression cache decode_chunk() looks up lines in, or None. Set by use_cache(), in each worker
+# process when decoding with multiple jobs.
+decode_cache_directory: Optional[str] = None
+
+# Each thread's (directory, cache) for decode_cache(), since SQLite connections can't be shared between threads.
+decode_caches = threading.local()
+
+
 # Converts bits to a byte.
 def bits_to_byte(b7: bool, b6: bool, b5: bool, b4: bool, b3: bool, b2: bool, b1: bool, b0: bool) -> int:
     return b0 | int(b1) << 1 | int(b2) << 2 | int(b3) << 3 | int(b4) << 4 | int(b5) << 5 | int(b6) << 6 | int(b7) << 7
@@ -33,23 +85,26 @@ def bytes_to_bits(bytes_: bytes) -> Iterator[bool]:
             yield bit
 
 
-# Lazily decodes encoded lines into bytes.
-def decode_lines(lines) -> Iterator[int]:
-    assert len(lines) % 8 == 0
+# Lazily decodes encoded lines into bytes. Raises BitCountError at the end if the lines don't make whole bytes.
+# first_line_num is the line number of the first line, for errors. If cache is given, values are looked up in and added
+# to it.
+def decode_lines(lines: Iterable[str], first_line_num: int = 1, cache: Optional[ExpressionCache] = None) -> Iterator[int]:
     bits = numpy.empty(8, dtype=bool)
     j = 0
-    for i, line in enumerate(lines, 1):
+    for i, line in enumerate(lines, first_line_num):
         line = line.strip()
         if not line:
             raise DecodeError(i, "Line must not be blank.")
         try:
-            expr = exprparse.parse(line)
+            if cache is not None:
+                value = cache.exact_value(line)
+            else:
+                value = lazyeval.exact_value(exprparse.parse(line))
         except exprparse.InvalidSyntax as e:
             raise DecodeError(i, str(e))
-        try:
-            bit = expr.exact_value.value
-        except ValueError:
+        if value is None:
             raise DecodeError(i, "Expression does not evaluate to a single value.")
+        bit = value.value
 
         bits[j] = bit
         if j == 7:
@@ -57,104 +112,487 @@ def decode_lines(lines) -> Iterator[int]:
             j = 0
         else:
             j += 1
+    if j != 0:
+        raise BitCountError()
 
 
-def decode(input_path: str, output_path: str) -> None:
-    with ExitStack() as context:
+# Decodes one chunk of lines, given with the line number of its first line. Returns the decoded bytes, the error which
+# stopped decoding, if any, and the number of cache hits and misses.
+def decode_chunk(chunk: Tuple[int, List[str]]) -> Tuple[bytes, Optional[Exception], Tuple[int, int]]:
+    first_line_num, lines = chunk
+    data = bytearray()
+    error: Optional[Exception] = None
+    cache = decode_cache()
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    try:
+        for byte in decode_lines(lines, first_line_num, cache):
+            data.append(byte)
+    except (DecodeError, BitCountError) as e:
+        error = e
+    if cache is None:
+        return bytes(data), error, (0, 0)
+    # Worker processes are terminated without cleanup, so write new entries now.
+    cache.flush()
+    return bytes(data), error, (cache.hits - hits, cache.misses - misses)
+
+
+# Decodes lines in a pool of jobs processes, yielding the results of decode_chunk() in order. Chunks are whole bytes
+# of lines, so line numbers and the bit count check work as for serial decoding. If cache_directory is given, each
+# process uses the expression cache there.
+def decode_parallel(lines: Iterable[str], jobs: int,
+                    cache_directory: Optional[str] = None) -> Iterator[Tuple[bytes, Optional[Exception], Tuple[int, int]]]:
+    chunk_size = 8 * decode_chunk_bytes
+    lines = iter(lines)
+    chunks = ((1 + i * chunk_size, chunk) for i, chunk in enumerate(iter(lambda: list(islice(lines, chunk_size)), [])))
+    with Pool(jobs, use_cache, (cache_directory,)) as pool:
+        yield from ordered_map_with_stats(pool, decode_chunk, chunks, 2 * jobs)
+
+
+# Like ordered_map(), but if stats are enabled, collects them in the worker processes too.
+def ordered_map_with_stats(pool: Pool, function: Callable[[Any], Any], items: Iterable[Any], window: int) -> Iterator[Any]:
+    if not stats.enabled:
+        yield from ordered_map(pool, function, items, window)
+        return
+    for result, snapshot in ordered_map(pool, call_with_stats, ((function, item) for item in items), window):
+        stats.merge(snapshot)
+        yield result
+
+
+# Calls function(item) with stats enabled, returning its result and the stats it collected.
+def call_with_stats(task: Tuple[Callable[[Any], Any], Any]) -> Tuple[Any, Dict[str, Any]]:
+    function, item = task
+    stats.enable()
+    stats.reset()
+    result = function(item)
+    return result, stats.snapshot()
+
+
+# Encodes one chunk of input, given as (seed, chunk index, data), to the text of its lines, drawing expressions from the
+# bank set by use_bank().
+def encode_chunk(chunk: Tuple[Optional[int], int, bytes]) -> str:
+    seed, index, data = chunk
+    return encode_data(seed, index, data, encode_bank)
+
+
+# Encodes one chunk of input to the text of its lines. The chunk's random number generator is seeded from the seed and
+# the chunk index, or randomly if seed is None. If bank is given, expressions are drawn from it and recombined with its
+# probability, else generated.
+def encode_data(seed: Optional[int], index: int, data: bytes, bank: Optional[Tuple[ExpressionBank, float]]) -> str:
+    rng = random.Random() if seed is None else random.Random(f"{seed}:{index}")
+    if bank is not None:
+        bank_, recombine = bank
+        return "".join(f"{bank_.draw(boolean.from_bool(b), rng, recombine)}\n" for b in bytes_to_bits(data))
+    return "".join(f"{exprutility.random_expression_with_value(4, 5, boolean.from_bool(b), rng)}\n" for b in bytes_to_bits(data))
+
+
+def use_bank(bank: Optional[Tuple[ExpressionBank, float]]) -> None:
+    global encode_bank
+    encode_bank = bank
+
+
+def use_cache(directory: Optional[str]) -> None:
+    global decode_cache_directory
+    decode_cache_directory = directory
+
+
+# The current thread's connection to the cache set by use_cache(), opened when first needed, or None.
+def decode_cache() -> Optional[ExpressionCache]:
+    directory = decode_cache_directory
+    if directory is None:
+        return None
+    entry = getattr(decode_caches, "entry", None)
+    if entry is None or entry[0] != directory:
+        if entry is not None:
+            entry[1].close()
+        entry = decode_caches.entry = (directory, ExpressionCache(directory))
+    return entry[1]
+
+
+# Lazily reads lines from a file, chunk_size characters at a time. Raises ReadError if reading fails.
+def read_lines(file: TextIO, chunk_size: int, progress: Optional[tqdm] = None) -> Iterator[str]:
+    while True:
         try:
-            input_file: TextIOBase = context.enter_context(open(input_path, mode="r", encoding="ascii"))
-        except FileNotFoundError:
-            print(f'Input file "{input_path}" not found.')
-            return
+            lines: List[str] = file.readlines(chunk_size)
         except OSError:
-            print(f'Failed to open input file "{input_path}".')
+            raise ReadError()
+        if not lines:
             return
+        if progress is not None:
+            progress.update(sum(map(len, lines)))
+        yield from lines
+
 
-        print("Reading input...", end="")
+# Reads size bytes from a binary file, or fewer at the end of the file. Raises ReadError if reading fails.
+def read_bytes(file: BinaryIO, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
         try:
-            lines: List[str] = list(input_file)
+            part = file.read(size - len(data))
         except OSError:
-            print("\nFailed to read from input file.")
+            raise ReadError()
+        if not part:
+            break
+        data += part
+    return bytes(data)
+
+
+# Decodes lines read from a text stream, writing the bytes to a binary stream. If jobs is more than 1, decodes with
+# that many processes. If cache_directory is given, expression values are looked up in and added to the expression
+# cache there. Returns the number of cache hits and misses.
+# Raises DecodeError or BitCountError for invalid input, after writing the bytes decoded before the error, ReadError if
+# reading fails, and OSError if writing fails.
+def decode_stream(input_file: TextIO, output_file: BinaryIO, jobs: int = 1, cache_directory: Optional[str] = None,
+                  progress: Optional[tqdm] = None) -> Tuple[int, int]:
+    lines = read_lines(input_file, read_chunk_size, progress)
+    buffer = bytearray()
+    hits = misses = 0
+    with ExitStack() as context:
+        try:
+            if jobs > 1:
+                for data, error, (chunk_hits, chunk_misses) in decode_parallel(lines, jobs, cache_directory):
+                    hits += chunk_hits
+                    misses += chunk_misses
+                    buffer += data
+                    if error is not None:
+                        raise error
+                    output_file.write(buffer)
+                    buffer.clear()
+            else:
+                cache = None if cache_directory is None else context.enter_context(ExpressionCache(cache_directory))
+                for byte in decode_lines(lines, cache=cache):
+                    buffer.append(byte)
+                    if len(buffer) >= write_buffer_size:
+                        output_file.write(buffer)
+                        buffer.clear()
+                if cache is not None:
+                    hits, misses = cache.hits, cache.misses
+            output_file.write(buffer)
+        except (DecodeError, BitCountError):
+            # Keep the bytes decoded before the error, as if they had been written unbuffered.
+            try:
+                output_file.write(buffer)
+            except OSError:
+                pass
+            raise
+    output_file.flush()
+    return hits, misses
+
+
+# Encodes data read from a binary stream, writing the lines to a text stream. If jobs is more than 1, encodes with that
+# many processes. The same seed always gives the same output. If bank is given, expressions are drawn from it instead of
+# generated, and recombined with probability recombine.
+# Raises ReadError if reading fails, and OSError if writing fails.
+def encode_stream(input_file: BinaryIO, output_file: TextIO, jobs: int = 1, seed: Optional[int] = None,
+                  bank: Optional[ExpressionBank] = None, recombine: float = 0.0, progress: Optional[tqdm] = None) -> None:
+    chunks = ((seed, i, data) for i, data in enumerate(iter(lambda: read_bytes(input_file, encode_chunk_bytes), b"")))
+    bank_: Optional[Tuple[ExpressionBank, float]] = None if bank is None else (bank, recombine)
+    with ExitStack() as context:
+        if jobs > 1:
+            pool = context.enter_context(Pool(jobs, use_bank, (bank_,)))
+            encoded = ordered_map_with_stats(pool, encode_chunk, chunks, 2 * jobs)
+        else:
+            use_bank(bank_)
+            context.callback(use_bank, None)
+            encoded = map(encode_chunk, chunks)
+        for text in encoded:
+            output_file.write(text)
+            if progress is not None:
+                # One line per bit.
+                progress.update(text.count("\n"))
+    output_file.flush()
+
+
+# Like decode_stream(), but consumes chunks of encoded text (bytes or str, split anywhere) from an async iterable, such
+# as stream_chunks() of an asyncio.StreamReader, and yields the decoded bytes in chunks. Decoding runs in executor, with
+# at most window chunks of lines in flight, so input is read ahead of the consumer by a bounded amount, and reading
+# overlaps with decoding. Raises DecodeError or BitCountError for invalid input, after yielding the bytes decoded before
+# the error.
+# By default, a process pool is used, with the expression cache in cache_directory if given. A given executor should
+# also be a process pool, set up with use_cache() as its initializer to use a cache: parsing and interning aren't
+# thread safe, so a thread pool would only help overlap I/O, and isn't supported.
+async def decode_async(chunks: AsyncIterable[Union[bytes, str]], executor: Optional[Executor] = None, window: int = 4,
+                       cache_directory: Optional[str] = None) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    owned: Optional[Executor] = None
+    if executor is None:
+        owned = executor = ProcessPoolExecutor(initializer=use_cache, initargs=(cache_directory,))
+    chunk_size = 8 * decode_chunk_bytes
+    pending: Deque["asyncio.Future[Tuple[bytes, Optional[Exception], Tuple[int, int]]]"] = deque()
+    try:
+        lines: List[str] = []
+        first_line_num = 1
+        async for line in split_lines(chunks):
+            lines.append(line)
+            if len(lines) == chunk_size:
+                pending.append(loop.run_in_executor(executor, decode_chunk, (first_line_num, lines)))
+                first_line_num += len(lines)
+                lines = []
+                if len(pending) >= window:
+                    data, error, _ = await pending.popleft()
+                    yield data
+                    if error is not None:
+                        raise error
+        if lines:
+            pending.append(loop.run_in_executor(executor, decode_chunk, (first_line_num, lines)))
+        while pending:
+            data, error, _ = await pending.popleft()
+            yield data
+            if error is not None:
+                raise error
+    finally:
+        await shutdown_executor(owned, pending)
+
+
+# Like encode_stream(), but consumes chunks of data (split anywhere) from an async iterable, such as stream_chunks() of
+# an asyncio.StreamReader, and yields the encoded text in chunks. Encoding runs in executor (by default a process pool,
+# as for decode_async()), with at most window chunks in flight, so input is read ahead of the consumer by a bounded
+# amount, and reading overlaps with encoding. The output for a given seed is the same as encode_stream()'s.
+async def encode_async(chunks: AsyncIterable[bytes], seed: Optional[int] = None, bank: Optional[ExpressionBank] = None,
+                       recombine: float = 0.0, executor: Optional[Executor] = None, window: int = 4) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    bank_: Optional[Tuple[ExpressionBank, float]] = None if bank is None else (bank, recombine)
+    owned: Optional[Executor] = None
+    if executor is None:
+        # The bank is sent to each worker once, rather than with every chunk.
+        owned = executor = ProcessPoolExecutor(initializer=use_bank, initargs=(bank_,))
+    pending: Deque["asyncio.Future[str]"] = deque()
+    try:
+        index = 0
+        async for data in fixed_size_chunks(chunks, encode_chunk_bytes):
+            if owned is not None:
+                pending.append(loop.run_in_executor(executor, encode_chunk, (seed, index, data)))
+            else:
+                pending.append(loop.run_in_executor(executor, encode_data, seed, index, data, bank_))
+            index += 1
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        await shutdown_executor(owned, pending)
+
+
+# Cancels the work still pending when an async conversion stops, and shuts down its executor if it made one, waiting
+# for the work already running in another thread, so as not to block the event loop.
+async def shutdown_executor(executor: Optional[Executor], pending: Iterable["asyncio.Future[Any]"]) -> None:
+    for future in pending:
+        future.cancel()
+    if executor is not None:
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+
+# Reads an asyncio stream in chunks of up to size bytes.
+async def stream_chunks(reader: asyncio.StreamReader, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await reader.read(size)
+        if not chunk:
             return
-        print(" done")
+        yield chunk
+
+
+# Writes chunks (bytes, or str encoded as ASCII) to an asyncio stream, waiting for it to drain after each one, so the
+# chunks are produced no faster than the stream's reader consumes them.
+async def write_chunks(chunks: AsyncIterable[Union[bytes, str]], writer: asyncio.StreamWriter) -> None:
+    async for chunk in chunks:
+        writer.write(chunk.encode("ascii") if isinstance(chunk, str) else chunk)
+        await writer.drain()
 
-    if len(lines) % 8 != 0:
-        print("Number of input bits is not a multiple of 8.")
-        return
 
-    print("Decoding...")
+# Regroups chunks of bytes into chunks of exactly size bytes, except the last.
+async def fixed_size_chunks(chunks: AsyncIterable[bytes], size: int) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+# Splits chunks of text (bytes or str) into lines, without line endings.
+async def split_lines(chunks: AsyncIterable[Union[bytes, str]]) -> AsyncIterator[str]:
+    rest = ""
+    async for chunk in chunks:
+        text = rest + (chunk.decode("ascii") if isinstance(chunk, bytes) else chunk)
+        lines = text.split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+# Opens the file at path with the given mode (text files are ASCII), or gets stdin or stdout if path is "-". Files
+# opened are closed by context.
+def open_path(path: str, mode: str, context: ExitStack) -> IO[Any]:
+    if path != "-":
+        return context.enter_context(open(path, mode=mode, encoding=None if "b" in mode else "ascii"))
+    stream = sys.stdin if "r" in mode else sys.stdout
+    if "b" in mode:
+        return stream.buffer
+    wrapper = io.TextIOWrapper(stream.buffer, encoding="ascii")
+    # Leave stdin or stdout open.
+    context.callback(wrapper.detach)
+    return wrapper
+
+
+# The size of a file in bytes, or None if it isn't a regular file, like a pipe.
+def file_size(file: IO[Any]) -> Optional[int]:
+    try:
+        status = os.fstat(file.fileno())
+    except (OSError, ValueError):
+        return None
+    return status.st_size if stat.S_ISREG(status.st_mode) else None
+
+
+# Where to print messages, so they don't mix with output written to stdout.
+def message_file(output_path: str) -> TextIO:
+    return sys.stderr if output_path == "-" else sys.stdout
+
+
+# Decodes the input file into the output file. If jobs is more than 1, decodes with that many processes.
+# If cache_directory is given, expression values are cached there across runs (see exprcache.py), and the cache hit
+# rate is reported. Either path may be "-", for stdin or stdout.
+def decode(input_path: str, output_path: str, jobs: int = 1, cache_directory: Optional[str] = None) -> None:
+    log = message_file(output_path)
     with ExitStack() as context:
         try:
-            output_file = context.enter_context(open(output_path, mode="xb"))
+            input_file: TextIO = open_path(input_path, "r", context)
+        except FileNotFoundError:
+            print(f'Input file "{input_path}" not found.', file=log)
+            return
+        except OSError:
+            print(f'Failed to open input file "{input_path}".', file=log)
+            return
+
+        try:
+            output_file: BinaryIO = open_path(output_path, "xb", context)
         except FileExistsError:
-            print(f'Output file "{output_path}" already exists.')
+            print(f'Output file "{output_path}" already exists.', file=log)
             return
         except OSError:
-            print(f'Failed to open output file "{output_path}".')
+            print(f'Failed to open output file "{output_path}".', file=log)
             return
 
+        if cache_directory is not None:
+            try:
+                ExpressionCache(cache_directory).close()
+            except (OSError, sqlite3.Error):
+                print(f'Failed to open expression cache "{cache_directory}".', file=log)
+                return
+
+        print("Decoding...", file=log)
+        progress = context.enter_context(tqdm(total=file_size(input_file), unit="B", unit_scale=True))
         try:
-            for byte in decode_lines(tqdm(lines, unit="b")):
-                output_file.write(bytes((byte,)))
-        except DecodeError as e:
-            print(str(e))
+            hits, misses = decode_stream(input_file, output_file, jobs, cache_directory, progress)
+        except (DecodeError, BitCountError) as e:
+            print(str(e), file=log)
+            return
+        except ReadError:
+            print("Failed to read from input file.", file=log)
             return
         except OSError:
-            print("Failed to write to output file.")
+            print("Failed to write to output file.", file=log)
+            return
+        except sqlite3.Error as e:
+            print(f"Expression cache error: {e}", file=log)
             return
 
+    if cache_directory is not None:
+        lookups = hits + misses
+        print(f"Expression cache hit rate: {hits / lookups if lookups else 0:.1%} ({hits} of {lookups} lines)", file=log)
 
-def encode(input_path: str, output_path: str) -> None:
-    with ExitStack() as context:
+
+# Encodes the input file into the output file. If jobs is more than 1, encodes with that many processes.
+# The same seed always gives the same output. If bank_path is given, expressions are drawn from that expression bank
+# instead of generated, and recombined with probability recombine. Either path may be "-", for stdin or stdout.
+def encode(input_path: str, output_path: str, jobs: int = 1, seed: Optional[int] = None, bank_path: Optional[str] = None,
+           recombine: float = 0.0) -> None:
+    log = message_file(output_path)
+    bank: Optional[ExpressionBank] = None
+    if bank_path is not None:
+        print("Loading expression bank...", end="", file=log)
         try:
-            input_file = context.enter_context(open(input_path, mode="rb"))
+            bank = ExpressionBank.load(bank_path)
         except FileNotFoundError:
-            print(f'Input file "{input_path}" not found.')
+            print(f'\nExpression bank "{bank_path}" not found.', file=log)
             return
-        except OSError:
-            print(f'Failed to open input file "{input_path}".')
+        except (OSError, EOFError, UnicodeDecodeError):
+            print(f'\nFailed to read expression bank "{bank_path}".', file=log)
             return
+        except BankFormatError as e:
+            print(f"\nInvalid expression bank: {e}", file=log)
+            return
+        print(" done", file=log)
 
-        print("Reading input...", end="")
+    with ExitStack() as context:
         try:
-            data: bytes = input_file.read()
+            input_file: BinaryIO = open_path(input_path, "rb", context)
+        except FileNotFoundError:
+            print(f'Input file "{input_path}" not found.', file=log)
+            return
         except OSError:
-            print("\nFailed to read from input file.")
+            print(f'Failed to open input file "{input_path}".', file=log)
             return
-        print(" done")
-
-    bits = bytes_to_bits(data)
-    exprs = (exprutility.random_expression_with_value(4, 5, boolean.from_bool(b)) for b in bits)
 
-    print("Encoding...")
-    with ExitStack() as context:
         try:
-            output_file = context.enter_context(open(output_path, mode="x", encoding="ascii"))
+            output_file: TextIO = open_path(output_path, "x", context)
         except FileExistsError:
-            print(f'Output file "{output_path}" already exists.')
+            print(f'Output file "{output_path}" already exists.', file=log)
             return
         except OSError:
-            print(f'Failed to open output file "{output_path}".')
+            print(f'Failed to open output file "{output_path}".', file=log)
             return
 
+        print("Encoding...", file=log)
+        size = file_size(input_file)
+        progress = context.enter_context(tqdm(total=None if size is None else size * 8, unit="b"))
         try:
-            for expr in tqdm(exprs, total=len(data) * 8, unit="b"):
-                output_file.write(f"{expr}\n")
+            encode_stream(input_file, output_file, jobs, seed, bank, recombine, progress)
+        except ReadError:
+            print("Failed to read from input file.", file=log)
+            return
         except OSError:
-            print("Failed to write to output file.")
+            print("Failed to write to output file.", file=log)
             return
 
 
-if len(sys.argv) != 4:
-    print("Usage: fileconvert.py decode|encode <input_file> <output_file>")
-else:
-    mode: str = sys.argv[1]
-    mode = mode.lower()
-    input_path: str = sys.argv[2]
-    output_path: str = sys.argv[3]
+def main(args: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="fileconvert.py", description="Converts files to and from propositional form.")
+    parser.add_argument("mode", help="decode or encode")
+    parser.add_argument("input_path", metavar="input_file")
+    parser.add_argument("output_path", metavar="output_file")
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes to use (default: 1)")
+    parser.add_argument("--seed", type=int, help="random seed for encoding, for reproducible output")
+    parser.add_argument("--bank", dest="bank_path", metavar="BANK_FILE", help="expression bank to encode with (see exprbank.py)")
+    parser.add_argument("--recombine", type=float, default=0.0,
+                        help="probability of recombining expressions drawn from the bank (default: 0)")
+    parser.add_argument("--cache", dest="cache_directory", metavar="CACHE_DIR",
+                        help="directory of a persistent cache of expression values for decoding")
+    parser.add_argument("--stats", action="store_true", help="print statistics on where time went at the end")
+    args = parser.parse_args(args)
+    if args.jobs < 1:
+        parser.error("--jobs must be >= 1.")
+    if not 0 <= args.recombine <= 1:
+        parser.error("--recombine must be >= 0 and <= 1.")
+
+    log = message_file(args.output_path)
+    mode: str = args.mode.lower()
+    if mode not in ("decode", "encode"):
+        print(f'Invalid mode "{mode}".', file=log)
+        return
+    if args.stats:
+        stats.enable()
     if mode == "decode":
-        decode(input_path, output_path)
-    elif mode == "encode":
-        encode(input_path, output_path)
+        decode(args.input_path, args.output_path, args.jobs, args.cache_directory)
     else:
-        print(f'Invalid mode "{mode}".')
+        encode(args.input_path, args.output_path, args.jobs, args.seed, args.bank_path, args.recombine)
+    if args.stats:
+        print(file=log)
+        print(stats.format_stats(), file=log)
+
+
+# Only runs when executed as a script, so that worker processes can import this module.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+from boolean import BooleanValue, F, T
+from compiler import as_bool_column, column_length
+from expression import Expression, Literal, literal_f, literal_t, postorder, SimpleExpression, Variable
+from operation import BinaryOperation, binary_operations, bitwise_function, Operation, UnaryOperation, unary_operations
+from truthtable import Input, pack_column, PackedTruthTable
+
+from array import array
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Type, Union
+
+import numpy
+
+
+__all__ = [
+    "FlatExpression",
+    "FlatExpressionBuilder",
+    "opcode_literal_f",
+    "opcode_literal_t",
+    "opcode_variable",
+    "operation_opcodes"
+]
+
+
+opcode_literal_f = 0
+opcode_literal_t = 1
+opcode_variable = 2
+
+# The operation class for each opcode from 3 on.
+operation_classes: Tuple[Type[Operation], ...] = unary_operations + binary_operations
+operation_opcodes: Dict[Type[Operation], int] = {cls: i + 3 for i, cls in enumerate(operation_classes)}
+
+# Number of packed words of truth table rows evaluated at once by FlatExpression.truth.
+truth_chunk_words = 16
+
+# Approximate number of bytes of node values FlatExpression.evaluate() computes at once.
+evaluate_chunk_bytes = 1 << 24
+
+
+# An expression stored as arrays with one entry per node, instead of as linked objects.
+# Nodes are numbered so that every node comes after its operands, and the last node is the whole expression. Node i is
+# described by opcodes[i] and:
+#  - for a variable, lhs[i] is the index of its name in names.
+#  - for a unary operation, rhs[i] is the operand's node.
+#  - for a binary operation, lhs[i] and rhs[i] are the operands' nodes.
+# Unused entries are -1. Nodes may be shared, as in a DAG, so each node takes 9 bytes however it's used.
+class FlatExpression:
+    def __init__(self, opcodes: numpy.ndarray, lhs: numpy.ndarray, rhs: numpy.ndarray, names: Sequence[str]) -> None:
+        if not len(opcodes) == len(lhs) == len(rhs):
+            raise ValueError("opcodes, lhs and rhs must be the same length.")
+        if len(opcodes) == 0:
+            raise ValueError("An expression must have at least one node.")
+        self.opcodes = numpy.asarray(opcodes, dtype=numpy.uint8)
+        self.lhs = numpy.asarray(lhs, dtype=numpy.int32)
+        self.rhs = numpy.asarray(rhs, dtype=numpy.int32)
+        self.names: Tuple[str, ...] = tuple(names)
+        # Evaluation order, computed when first needed. See schedule().
+        self._schedule: Optional[List[Tuple[Any, numpy.ndarray, numpy.ndarray, numpy.ndarray]]] = None
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    @classmethod
+    def from_expression(cls, expr: Expression) -> "FlatExpression":
+        builder = FlatExpressionBuilder()
+        nodes: Dict[Expression, int] = {}
+        for subexpr in postorder(expr):
+            if isinstance(subexpr, SimpleExpression):
+                node = builder.simple(subexpr)
+            elif isinstance(subexpr, Operation):
+                node = builder.operation(type(subexpr), *(nodes[operand] for operand in subexpr.operands))
+            else:
+                raise TypeError(f"Can't flatten `{type(subexpr)}`.")
+            nodes[subexpr] = node
+        return builder.finish()
+
+    def to_expression(self) -> Expression:
+        exprs: List[Expression] = []
+        for opcode, lhs, rhs in zip(self.opcodes.tolist(), self.lhs.tolist(), self.rhs.tolist()):
+            if opcode == opcode_literal_f:
+                exprs.append(literal_f)
+            elif opcode == opcode_literal_t:
+                exprs.append(literal_t)
+            elif opcode == opcode_variable:
+                exprs.append(Variable(self.names[lhs]))
+            else:
+                cls = operation_classes[opcode - 3]
+                if issubclass(cls, BinaryOperation):
+                    exprs.append(cls(exprs[lhs], exprs[rhs]))
+                else:
+                    exprs.append(cls(exprs[rhs]))
+        return exprs[-1]
+
+    # The variable names in order of first occurrence, as in Expression.variables.
+    @property
+    def variables(self) -> Tuple[str, ...]:
+        return tuple(self.names[self.lhs[node]] for node in self.leaves() if self.opcodes[node] == opcode_variable)
+
+    # The variable and literal nodes reachable from the root, in order of first occurrence in a left to right traversal,
+    # which isn't necessarily the order of the nodes. Uses an explicit stack, like __str__().
+    def leaves(self) -> List[int]:
+        opcodes = self.opcodes.tolist()
+        lhs = self.lhs.tolist()
+        rhs = self.rhs.tolist()
+        result: List[int] = []
+        visited = bytearray(len(opcodes))
+        stack = [len(opcodes) - 1]
+        while stack:
+            node = stack.pop()
+            if visited[node]:
+                continue
+            visited[node] = 1
+            if opcodes[node] <= opcode_variable:
+                result.append(node)
+            else:
+                stack.append(rhs[node])
+                if lhs[node] >= 0:
+                    stack.append(lhs[node])
+        return result
+
+    def __str__(self) -> str:
+        opcodes = self.opcodes.tolist()
+        lhs = self.lhs.tolist()
+        rhs = self.rhs.tolist()
+        # Same format as Expression.__str__(), using an explicit stack of nodes and strings like join_parts().
+        pieces: List[str] = []
+        stack: List[Union[str, int]] = [len(opcodes) - 1]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+                continue
+            opcode = opcodes[item]
+            if opcode == opcode_literal_f:
+                pieces.append(str(F))
+            elif opcode == opcode_literal_t:
+                pieces.append(str(T))
+            elif opcode == opcode_variable:
+                pieces.append(self.names[lhs[item]])
+            else:
+                cls = operation_classes[opcode - 3]
+                if issubclass(cls, BinaryOperation):
+                    stack.extend((")", rhs[item], f" {cls.symbol} ", lhs[item]))
+                    pieces.append("(")
+                else:
+                    operand_opcode = opcodes[rhs[item]]
+                    if operand_opcode <= opcode_variable or issubclass(operation_classes[operand_opcode - 3], UnaryOperation):
+                        stack.append(rhs[item])
+                        pieces.append(cls.symbol)
+                    else:
+                        stack.extend((")", rhs[item]))
+                        pieces.append("(" + cls.symbol)
+        return "".join(pieces)
+
+    def __repr__(self) -> str:
+        return f"FlatExpression({str(self)})"
+
+    # Groups the operation nodes into steps which can each be evaluated with one array operation: nodes of the same
+    # operation whose operands are all computed by earlier steps. Returns (bitwise function, nodes, lhs, rhs) for each
+    # step, where lhs is unused for unary operations.
+    def schedule(self) -> List[Tuple[Any, numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+        if self._schedule is None:
+            opcodes = self.opcodes.tolist()
+            lhs = self.lhs.tolist()
+            rhs = self.rhs.tolist()
+            # Height of each node above the leaves.
+            heights = [0] * len(opcodes)
+            for i, opcode in enumerate(opcodes):
+                if opcode > opcode_variable:
+                    height = heights[rhs[i]]
+                    if lhs[i] >= 0:
+                        height = max(height, heights[lhs[i]])
+                    heights[i] = height + 1
+            heights_array = numpy.array(heights, dtype=numpy.int64)
+            is_operation = self.opcodes > opcode_variable
+            order = numpy.flatnonzero(is_operation)
+            order = order[numpy.lexsort((self.opcodes[order], heights_array[order]))]
+            keys = heights_array[order] * 256 + self.opcodes[order]
+            bounds = numpy.flatnonzero(numpy.diff(keys)) + 1
+            self._schedule = []
+            for nodes in numpy.split(order, bounds):
+                if len(nodes) == 0:
+                    continue
+                cls = operation_classes[self.opcodes[nodes[0]] - 3]
+                self._schedule.append((bitwise_function(cls), nodes, self.lhs[nodes], self.rhs[nodes]))
+        return self._schedule
+
+    # Evaluates every node, given the value of each variable name as an array (or scalar) of a common shape, and the
+    # values to use for F and T. Returns an array with the result for each node along the first axis, so memory use is
+    # the number of nodes times the size of the shape; callers evaluate large inputs in chunks.
+    def evaluate_nodes(self, columns: Mapping[str, Any], zero: Any, one: Any) -> numpy.ndarray:
+        zero = numpy.asarray(zero)
+        one = numpy.asarray(one, dtype=zero.dtype)
+        shape = broadcast_shape([zero] + list(columns.values()))
+        values = numpy.empty((len(self),) + shape, dtype=zero.dtype)
+        values[self.opcodes == opcode_literal_f] = zero
+        values[self.opcodes == opcode_literal_t] = one
+        variable_nodes = numpy.flatnonzero(self.opcodes == opcode_variable)
+        for name_index, node_indices in group_by(self.lhs[variable_nodes], variable_nodes):
+            # Variables only used by nodes unreachable from the root don't affect the result, and aren't in variables.
+            values[node_indices] = columns.get(self.names[name_index], zero)
+        for bitwise, nodes, lhs, rhs in self.schedule():
+            if issubclass(operation_classes[self.opcodes[nodes[0]] - 3], BinaryOperation):
+                result = bitwise(values[lhs], values[rhs])
+            else:
+                result = bitwise(values[rhs])
+            # ~ sets the unused bits of packed words and flips bool arrays, so results are always masked.
+            values[nodes] = result & one
+        return values
+
+    # Evaluates the expression for one assignment of its variables, by name.
+    def __call__(self, assignment: Mapping[str, Union[bool, BooleanValue]]) -> BooleanValue:
+        columns = {name: bool(assignment[name]) for name in self.variables}
+        return T if self.evaluate_nodes(columns, False, True)[-1] else F
+
+    # Evaluates the expression for many assignments, given as a column of values for each variable, by name. size gives
+    # the number of assignments, and is only needed if the expression has no variables. Assignments are evaluated in
+    # chunks of rows, so memory use is bounded by evaluate_chunk_bytes.
+    def evaluate(self, assignments: Mapping[str, Sequence[Union[bool, BooleanValue]]], size: Optional[int] = None) -> numpy.ndarray:
+        columns = {name: as_bool_column(assignments[name]) for name in self.variables}
+        length = column_length(list(columns.values()), size)
+        result = numpy.empty(length, dtype=bool)
+        chunk_rows = max(1, evaluate_chunk_bytes // len(self))
+        for start in range(0, length, chunk_rows):
+            end = min(start + chunk_rows, length)
+            chunk = {name: column[start:end] for name, column in columns.items()}
+            result[start:end] = self.evaluate_nodes(chunk, numpy.zeros(end - start, dtype=bool), numpy.ones(end - start, dtype=bool))[-1]
+        return result
+
+    # Computes the truth table, equal to to_expression().truth. Rows are evaluated 64 at a time as packed words, and
+    # truth_chunk_words words at a time, so memory use is bounded by the number of nodes.
+    @property
+    def truth(self) -> PackedTruthTable:
+        names = self.variables
+        num_rows = 1 << len(names)
+        num_words = (num_rows + 63) // 64
+        bits = numpy.empty(num_words, dtype=numpy.uint64)
+        for start in range(0, num_words, truth_chunk_words):
+            end = min(start + truth_chunk_words, num_words)
+            rows = numpy.arange(start * 64, min(end * 64, num_rows), dtype=numpy.int64)
+            columns = {name: pack_column((rows >> (len(names) - 1 - i)) & 1) for i, name in enumerate(names)}
+            ones = pack_column(numpy.ones(len(rows), dtype=bool))
+            bits[start:end] = self.evaluate_nodes(columns, numpy.zeros_like(ones), ones)[-1]
+        return PackedTruthTable(self.table_inputs(), bits, self.__str__)
+
+    # The inputs of truth, in the same order as for Expression.truth: each variable and literal value, in order of
+    # first occurrence.
+    def table_inputs(self) -> Tuple[Input, ...]:
+        inputs: List[Input] = []
+        seen = set()
+        for node in self.leaves():
+            opcode = int(self.opcodes[node])
+            if opcode == opcode_variable:
+                tag = Variable(self.names[self.lhs[node]])
+                values = None
+            else:
+                tag = T if opcode == opcode_literal_t else F
+                values = {tag}
+            if tag not in seen:
+                seen.add(tag)
+                inputs.append(Input(tag, values))
+        return tuple(inputs)
+
+
+# The shape the arrays broadcast to. numpy.broadcast() takes at most 32 arrays on older versions of numpy, and
+# numpy.broadcast_shapes() is too new, so the shapes are combined one at a time.
+def broadcast_shape(arrays: Sequence[Any]) -> Tuple[int, ...]:
+    shape: Tuple[int, ...] = ()
+    for array in arrays:
+        # broadcast_to() makes a view without allocating the shape's elements.
+        shape = numpy.broadcast(numpy.broadcast_to(False, shape), array).shape
+    return shape
+
+
+# Groups values by key, returning (key, values) pairs.
+def group_by(keys: numpy.ndarray, values: numpy.ndarray) -> List[Tuple[int, numpy.ndarray]]:
+    order = numpy.argsort(keys, kind="stable")
+    keys = keys[order]
+    bounds = numpy.flatnonzero(numpy.diff(keys)) + 1
+    return [(int(group_keys[0]), group) for group_keys, group in zip(numpy.split(keys, bounds), numpy.split(values[order], bounds)) if len(group)]
+
+
+# Builds a FlatExpression node by node, operands first. Variable and literal nodes are shared.
+class FlatExpressionBuilder:
+    def __init__(self) -> None:
+        self.opcodes = array("B")
+        self.lhs = array("i")
+        self.rhs = array("i")
+        self.names: List[str] = []
+        self.leaf_nodes: Dict[Any, int] = {}
+
+    def add(self, opcode: int, lhs: int = -1, rhs: int = -1) -> int:
+        self.opcodes.append(opcode)
+        self.lhs.append(lhs)
+        self.rhs.append(rhs)
+        return len(self.opcodes) - 1
+
+    # Adds a literal or variable, returning its node.
+    def simple(self, expr: SimpleExpression) -> int:
+        if isinstance(expr, Literal):
+            key: Any = expr.value
+        elif isinstance(expr, Variable):
+            key = expr.name
+        else:
+            raise TypeError(f"Can't flatten `{type(expr)}`.")
+        node = self.leaf_nodes.get(key)
+        if node is None:
+            if isinstance(expr, Literal):
+                node = self.add(opcode_literal_t if expr.value else opcode_literal_f)
+            else:
+                self.names.append(expr.name)
+                node = self.add(opcode_variable, len(self.names) - 1)
+            self.leaf_nodes[key] = node
+        return node
+
+    # Adds an operation applied to operand nodes, returning its node.
+    def operation(self, cls: Type[Operation], *operands: int) -> int:
+        opcode = operation_opcodes[cls]
+        if issubclass(cls, BinaryOperation):
+            return self.add(opcode, operands[0], operands[1])
+        else:
+            return self.add(opcode, -1, operands[0])
+
+    # Makes the expression whose root is the last node added.
+    def finish(self) -> FlatExpression:
+        return FlatExpression(numpy.frombuffer(self.opcodes, dtype=numpy.uint8), numpy.frombuffer(self.lhs, dtype=numpy.int32),
+                              numpy.frombuffer(self.rhs, dtype=numpy.int32), self.names)
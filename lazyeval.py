@@ -0,0 +1,100 @@
+from boolean import BooleanValue, F, T
+from expression import Expression, Literal, postorder, TruthTableEngine, Variable
+from operation import bitwise_function, Operation
+import stats
+
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+
+__all__ = [
+    "exact_value",
+    "ShortCircuitEngine"
+]
+
+
+# Number of variables whose assignments are evaluated together, as the bits of one int.
+chunk_vars = 12
+
+
+# Finds the value of an expression if it's exact, else returns None, without building any truth tables.
+# Assignments are evaluated bit-parallel, 2^chunk_vars at a time, and evaluation stops as soon as both F and T have
+# been seen, so expressions which aren't exact are usually rejected after the first chunk.
+@stats.timed("lazyeval.exact_value")
+def exact_value(expr: Expression) -> Optional[BooleanValue]:
+    nodes = list(postorder(expr))
+    variables = [node for node in nodes if isinstance(node, Variable)]
+    num_low = min(len(variables), chunk_vars)
+    num_high = len(variables) - num_low
+    mask = (1 << (1 << num_low)) - 1
+    patterns = variable_patterns(num_low)
+
+    # Each node as (function, operand indices), where function is None for leaves.
+    index: Dict[Expression, int] = {node: i for i, node in enumerate(nodes)}
+    program: List[Tuple[Optional[Callable[..., Any]], Tuple[int, ...]]] = []
+    leaves: List[int] = [0] * len(nodes)
+    for i, node in enumerate(nodes):
+        if isinstance(node, Operation):
+            program.append((bitwise_function(node), tuple(index[operand] for operand in node.operands)))
+        elif isinstance(node, Literal):
+            program.append((None, ()))
+            leaves[i] = mask if node.value else 0
+        elif isinstance(node, Variable):
+            program.append((None, ()))
+        else:
+            raise TypeError(f"Can't evaluate `{type(node)}`.")
+    var_indices = [index[var] for var in variables]
+
+    seen: Optional[int] = None
+    for chunk in range(1 << num_high):
+        values = leaves[:]
+        for var_num, i in enumerate(var_indices):
+            if var_num < num_low:
+                values[i] = patterns[var_num]
+            else:
+                values[i] = mask if (chunk >> (var_num - num_low)) & 1 else 0
+        for i, (function, operands) in enumerate(program):
+            if function is not None:
+                values[i] = function(*(values[j] for j in operands)) & mask
+        result = values[-1]
+        if result == 0:
+            value = 0
+        elif result == mask:
+            value = 1
+        else:
+            return None
+        if seen is None:
+            seen = value
+        elif seen != value:
+            return None
+    return T if seen else F
+
+
+pattern_cache: Dict[int, List[int]] = {}
+
+
+# The bit patterns for num_vars variables over all of their 2^num_vars assignments, where bit i of variable j's
+# pattern is its value in assignment i.
+def variable_patterns(num_vars: int) -> List[int]:
+    patterns = pattern_cache.get(num_vars)
+    if patterns is None:
+        size = 1 << num_vars
+        patterns = []
+        for j in range(num_vars):
+            block = 1 << j
+            # block ones preceded by block zeros, repeated.
+            unit = ((1 << block) - 1) << block
+            pattern = 0
+            for offset in range(0, size, 2 * block):
+                pattern |= unit << offset
+            patterns.append(pattern)
+        pattern_cache[num_vars] = patterns
+    return patterns
+
+
+# Answers questions about exactness with exact_value(), without building truth tables.
+class ShortCircuitEngine(TruthTableEngine):
+    def values(self, expr: Expression) -> FrozenSet[BooleanValue]:
+        value = exact_value(expr)
+        if value is None:
+            return frozenset((F, T))
+        return frozenset((value,))
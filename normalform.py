@@ -0,0 +1,323 @@
+from boolean import BooleanValue, F, from_bool, T
+from expression import Expression, Literal, literal_f, literal_t, postorder, Variable
+from operation import Conjunction, Disjunction, Negation, Operation
+from sat import CNF, encode, gate_clauses
+from truthtable import PackedTruthTable, TruthTable
+
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy
+
+
+__all__ = [
+    "cnf_expression",
+    "dnf_expression",
+    "minimize_cnf",
+    "minimize_dnf",
+    "NormalFormTooLarge",
+    "to_cnf",
+    "to_dnf"
+]
+
+
+# A term (conjunction) or clause (disjunction) of literals, each given as (variable name, value).
+Term = FrozenSet[Tuple[str, bool]]
+
+
+class NormalFormTooLarge(ValueError):
+    def __str__(self) -> str:
+        return "Normal form has too many terms."
+
+
+# Maximum number of terms or clauses of a normal form built by distribution, at any step.
+distributive_limit = 256
+
+# Maximum number of variables for exact Quine-McCluskey minimization. Larger functions are minimized heuristically.
+qm_max_vars = 10
+
+
+# Converts expr to an equivalent DNF by distribution, as a list of terms. Raises NormalFormTooLarge if it would have
+# more than max_terms terms.
+def dnf_terms(expr: Expression, max_terms: int = distributive_limit) -> List[Term]:
+    return distribute(expr, T, False, max_terms)
+
+
+# Converts expr to an equivalent CNF by distribution, as a list of clauses. Raises NormalFormTooLarge if it would have
+# more than max_clauses clauses.
+def cnf_clauses(expr: Expression, max_clauses: int = distributive_limit) -> List[Term]:
+    return distribute(expr, T, True, max_clauses)
+
+
+# Computes the DNF, or the CNF if cnf is true, of expr being value. Only the forms and values of subexpressions which
+# that depends on are built.
+# Each operation is expanded from the prime implicants or implicates of its join table (see join_cubes()), rather than
+# from every row, so an input which is already in the normal form keeps its size: as a DNF, it is the disjunction over
+# the implicants of all their operands having the given values, and as a CNF, the conjunction over the implicates of
+# any of them having the given values.
+def distribute(expr: Expression, value: BooleanValue, cnf: bool, limit: int) -> List[Term]:
+    nodes = list(postorder(expr))
+    # The values each subexpression's form is needed for, found parents first.
+    needed: Dict[Expression, Set[BooleanValue]] = {expr: {value}}
+    for node in reversed(nodes):
+        if isinstance(node, Operation):
+            for node_value in needed.get(node, ()):
+                for cube in join_cubes(node, node_value, cnf):
+                    for i, operand_value in cube:
+                        needed.setdefault(node.operands[i], set()).add(operand_value)
+
+    forms: Dict[Tuple[Expression, BooleanValue], List[Term]] = {}
+    for node in nodes:
+        for node_value in needed.get(node, ()):
+            if isinstance(node, Literal):
+                # The empty clause is F, and the empty term is T.
+                terms = [frozenset()] if (node.value == node_value) != cnf else []
+            elif isinstance(node, Variable):
+                terms = [frozenset(((node.name, bool(node_value)),))]
+            elif isinstance(node, Operation):
+                terms = []
+                for cube in join_cubes(node, node_value, cnf):
+                    # The operands having the cube's values: all of them for a term, any of them for a clause.
+                    combined = [frozenset()]
+                    for i, operand_value in cube:
+                        combined = product_terms(combined, forms[node.operands[i], operand_value], limit)
+                    terms.extend(combined)
+                terms = absorb(terms)
+                if len(terms) > limit:
+                    raise NormalFormTooLarge()
+            else:
+                raise TypeError(f"Can't convert `{type(node)}`.")
+            forms[node, node_value] = terms
+    return forms[expr, value]
+
+
+# The prime implicates (if cnf is true) or prime implicants of operation's join table being value, as (operand
+# position, operand value) pairs, from the clauses sat.gate_clauses() gives the operation's output.
+def join_cubes(operation: Operation, value: BooleanValue, cnf: bool) -> List[Tuple[Tuple[int, BooleanValue], ...]]:
+    arity = len(operation.operands)
+    # The clauses of "output is not value, or ...", which are implicates of value, and "output is value, or ...", whose
+    # negations are implicants.
+    output = (arity, not value) if cnf else (arity, bool(value))
+    return [tuple((i, from_bool(literal_value != (not cnf))) for i, literal_value in clause if i != arity)
+            for clause in gate_clauses(operation.join, arity) if output in clause]
+
+
+# Combines every term of a with every term of b. Pairs which contain a variable with both values are dropped.
+def product_terms(a: Sequence[Term], b: Sequence[Term], limit: int) -> List[Term]:
+    terms = []
+    for lhs in a:
+        for rhs in b:
+            term = lhs | rhs
+            if len({name for name, _ in term}) == len(term):
+                terms.append(term)
+    terms = absorb(terms)
+    if len(terms) > limit:
+        raise NormalFormTooLarge()
+    return terms
+
+
+# Removes duplicate terms, and terms which contain another term.
+def absorb(terms: Iterable[Term]) -> List[Term]:
+    kept: List[Term] = []
+    for term in sorted(set(terms), key=lambda term: (len(term), sorted(term))):
+        if not any(other <= term for other in kept):
+            kept.append(term)
+    return kept
+
+
+# Converts expr to an equivalent DNF expression by distribution. Raises NormalFormTooLarge if it would have more than
+# max_terms terms.
+def to_dnf(expr: Expression, max_terms: int = distributive_limit) -> Expression:
+    return dnf_expression(dnf_terms(expr, max_terms), [var.name for var in expr.variables])
+
+
+# Converts expr to a CNF which is satisfiable exactly when expr could be T.
+# Small expressions are converted by distribution, which gives an equivalent CNF over just expr's variables. If that
+# would have more than max_clauses clauses, the expression is Tseitin encoded instead (see sat.encode()), which adds a
+# variable per subexpression but grows linearly.
+def to_cnf(expr: Expression, max_clauses: int = distributive_limit) -> CNF:
+    try:
+        clauses = cnf_clauses(expr, max_clauses)
+    except NormalFormTooLarge:
+        return encode(expr, T)
+    cnf = CNF()
+    for var in expr.variables:
+        cnf.names[var.name] = cnf.new_var()
+    for clause in clauses:
+        cnf.add_clause(sorted((cnf.names[name] if value else -cnf.names[name] for name, value in clause), key=abs))
+    return cnf
+
+
+# Builds a disjunction of conjunctions from terms. Variables are ordered as in names, if given, else alphabetically.
+def dnf_expression(terms: Sequence[Term], names: Optional[Sequence[str]] = None) -> Expression:
+    return two_level_expression(terms, names, Disjunction, Conjunction, literal_f, literal_t)
+
+
+# Builds a conjunction of disjunctions from clauses. Variables are ordered as in names, if given, else alphabetically.
+def cnf_expression(clauses: Sequence[Term], names: Optional[Sequence[str]] = None) -> Expression:
+    return two_level_expression(clauses, names, Conjunction, Disjunction, literal_t, literal_f)
+
+
+def two_level_expression(terms: Sequence[Term], names: Optional[Sequence[str]], outer: type, inner: type, outer_empty: Literal,
+                         inner_empty: Literal) -> Expression:
+    order: Dict[str, int] = {} if names is None else {name: i for i, name in enumerate(names)}
+    exprs: List[Expression] = []
+    for term in sorted(terms, key=lambda term: sorted((order.get(name, len(order)), name, value) for name, value in term)):
+        literals = [Variable(name) if value else Negation(Variable(name))
+                    for name, value in sorted(term, key=lambda literal: (order.get(literal[0], len(order)), literal[0]))]
+        exprs.append(chain(inner, literals, inner_empty))
+    return chain(outer, exprs, outer_empty)
+
+
+# Joins exprs with a left-associative binary operation, or gives empty if there are none.
+def chain(operation: type, exprs: Sequence[Expression], empty: Expression) -> Expression:
+    if not exprs:
+        return empty
+    result = exprs[0]
+    for expr in exprs[1:]:
+        result = operation(result, expr)
+    return result
+
+
+# Finds a minimal DNF for a truth table or expression, as an expression. Functions of up to qm_max_vars variables are
+# minimized by Quine-McCluskey; larger ones by an Espresso-style expand and irredundant cover heuristic.
+def minimize_dnf(source: Union[Expression, TruthTable]) -> Expression:
+    names, column = function_column(source)
+    return dnf_expression(minimize_cubes(names, column), names)
+
+
+# Finds a minimal CNF for a truth table or expression, as an expression, by minimizing the DNF of its negation.
+def minimize_cnf(source: Union[Expression, TruthTable]) -> Expression:
+    names, column = function_column(source)
+    terms = minimize_cubes(names, ~column)
+    return cnf_expression([frozenset((name, not value) for name, value in term) for term in terms], names)
+
+
+# Gets the variable names of a truth table or expression, and its output column as a boolean array with an axis per
+# variable. Inputs with a single value are dropped.
+def function_column(source: Union[Expression, TruthTable]) -> Tuple[List[str], numpy.ndarray]:
+    table = source.truth if isinstance(source, Expression) else source
+    if not isinstance(table, PackedTruthTable):
+        table = PackedTruthTable.from_table(table)
+    column = table.column.reshape(tuple(len(i.values) for i in table.inputs))
+    names: List[str] = []
+    selection: List[Union[int, slice]] = []
+    for i in table.inputs:
+        if len(i.values) == 1:
+            selection.append(0)
+        elif isinstance(i.tag, Variable):
+            names.append(i.tag.name)
+            selection.append(slice(None))
+        else:
+            raise ValueError(f"Input {i.tag} is not a variable.")
+    return names, column[tuple(selection)]
+
+
+# Minimizes the function given by column (with an axis per name) into a list of terms covering its T entries.
+def minimize_cubes(names: Sequence[str], column: numpy.ndarray) -> List[Term]:
+    if len(names) <= qm_max_vars:
+        cubes = quine_mccluskey(column)
+    else:
+        cubes = espresso(column)
+    return [frozenset((names[i], bool(value)) for i, value in enumerate(cube) if value is not None) for cube in cubes]
+
+
+# A cube gives each variable's value, or None where it is free.
+Cube = Tuple[Optional[bool], ...]
+
+
+# Finds the prime implicants by repeatedly merging implicants which differ in one variable, then picks the essential
+# ones, and covers the rest of the minterms greedily.
+def quine_mccluskey(column: numpy.ndarray) -> List[Cube]:
+    num_vars = column.ndim
+    minterms = [tuple(bool(value) for value in index) for index in zip(*numpy.nonzero(column))] if num_vars else ([()] if column else [])
+    implicants = set(minterms)
+    primes = set()
+    while implicants:
+        merged = set()
+        used = set()
+        # Group by the positions of free variables, so that only compatible cubes are compared.
+        groups: Dict[Tuple[int, ...], List[Cube]] = {}
+        for cube in implicants:
+            groups.setdefault(tuple(i for i, value in enumerate(cube) if value is None), []).append(cube)
+        for cubes in groups.values():
+            present = set(cubes)
+            for cube in cubes:
+                for i, value in enumerate(cube):
+                    if value is True:
+                        other = cube[:i] + (False,) + cube[i + 1:]
+                        if other in present:
+                            merged.add(cube[:i] + (None,) + cube[i + 1:])
+                            used.add(cube)
+                            used.add(other)
+        primes |= implicants - used
+        implicants = merged
+
+    # Cover selection.
+    covers = {prime: {m for m in minterms if cube_contains(prime, m)} for prime in primes}
+    uncovered = set(minterms)
+    chosen: List[Cube] = []
+    for m in minterms:
+        containing = [prime for prime in primes if m in covers[prime]]
+        if len(containing) == 1 and containing[0] not in chosen:
+            chosen.append(containing[0])
+            uncovered -= covers[containing[0]]
+    while uncovered:
+        best = max(sorted(primes, key=cube_sort_key), key=lambda prime: len(covers[prime] & uncovered))
+        chosen.append(best)
+        uncovered -= covers[best]
+    return sorted(chosen, key=cube_sort_key)
+
+
+def cube_contains(cube: Cube, minterm: Cube) -> bool:
+    return all(value is None or value == m for value, m in zip(cube, minterm))
+
+
+def cube_sort_key(cube: Cube) -> Tuple[int, ...]:
+    return tuple(2 if value is None else int(value) for value in cube)
+
+
+# The index into a column with an axis per variable selecting the entries of cube.
+def cube_index(cube: Cube) -> Tuple[Union[int, slice], ...]:
+    return tuple(slice(None) if value is None else int(value) for value in cube)
+
+
+# Espresso-style heuristic minimization: each uncovered T entry is expanded into a cube by freeing variables while the
+# cube stays within the T entries, preferring variables which cover more uncovered entries, then cubes covered by the
+# others are removed.
+def espresso(column: numpy.ndarray) -> List[Cube]:
+    num_vars = column.ndim
+    uncovered = column.copy()
+    cubes: List[Cube] = []
+    while uncovered.any():
+        start = numpy.unravel_index(numpy.argmax(uncovered), uncovered.shape)
+        cube: List[Optional[bool]] = [bool(value) for value in start]
+        while True:
+            best = None
+            best_gain = -1
+            for i in range(num_vars):
+                if cube[i] is None:
+                    continue
+                candidate = cube[:i] + [None] + cube[i + 1:]
+                index = cube_index(tuple(candidate))
+                if column[index].all():
+                    gain = int(numpy.count_nonzero(uncovered[index]))
+                    if gain > best_gain:
+                        best, best_gain = i, gain
+            if best is None:
+                break
+            cube[best] = None
+        cubes.append(tuple(cube))
+        uncovered[cube_index(tuple(cube))] = False
+
+    # Irredundant cover: drop cubes, smallest first, whose entries are all covered by other cubes.
+    counts = numpy.zeros(column.shape, dtype=numpy.int64)
+    for cube in cubes:
+        counts[cube_index(cube)] += 1
+    kept: List[Cube] = []
+    for cube in sorted(cubes, key=lambda cube: sum(value is None for value in cube)):
+        index = cube_index(cube)
+        if counts[index].min() >= 2:
+            counts[index] -= 1
+        else:
+            kept.append(cube)
+    return sorted(kept, key=cube_sort_key)
@@ -1,13 +1,17 @@
 from boolean import F, T
-from expression import CompoundExpression, Expression, SimpleExpression
-from truthtable import join_tables, TruthTable
+from expression import CompoundExpression, Expression, lazy_str, precompute_truth, SimpleExpression, truth_inputs
+from truthtable import expand_table, join_tables, TruthTable
 from utility import cached_property
 
+from itertools import product
+from typing import Any, Callable, Hashable, Optional, Sequence, Tuple, Union
+
 
 __all__ = [
     "Biconditional",
     "BinaryOperation",
     "binary_operations",
+    "bitwise_function",
     "Conjunction",
     "Disjunction",
     "ExclDisjunction",
@@ -21,32 +25,59 @@ __all__ = [
 
 
 class Operation(CompoundExpression):
+    __slots__ = ()
+
     join: TruthTable = None
+    # Computes join elementwise using only the &, |, ^ and ~ operators, so it works on boolean arrays and bit vectors.
+    bitwise: Callable[..., Any] = None
+    # If set, called with an operation before computing its truth table. If it returns a different (equivalent)
+    # expression, the truth table is computed from that instead. See simplify.auto_simplify().
+    truth_preprocessor: Callable[[Expression], Expression] = None
 
 
 class UnaryOperation(Operation):
+    __slots__ = ("rhs",)
+
     symbol: str = None
 
     def __init__(self, rhs: Expression) -> None:
         self.rhs = rhs
 
+    @staticmethod
+    def interning_key(rhs: Expression) -> Tuple[Hashable, ...]:
+        return rhs,
+
+    @property
+    def structure(self) -> Tuple[Hashable, ...]:
+        return self.rhs,
+
+    @property
+    def operands(self) -> Tuple[Expression, ...]:
+        return self.rhs,
+
     @cached_property
     def truth(self) -> TruthTable:
-        table = join_tables(self.join, (self.rhs.truth,))
-        table.name = str(self)
+        table = preprocessed_truth(self)
+        if table is not None:
+            return table
+        precompute_truth(self.rhs)
+        table = join_tables(self.join, (self.rhs.truth,), self.bitwise)
+        table.name = lazy_str(self)
         return table
 
-    def __str__(self) -> str:
+    def str_parts(self) -> Sequence[Union[str, Expression]]:
         if isinstance(self.rhs, SimpleExpression) or isinstance(self.rhs, UnaryOperation):
-            return f"{self.symbol}{self.rhs}"
+            return self.symbol, self.rhs
         else:
-            return f"({self.symbol}{self.rhs})"
+            return "(", self.symbol, self.rhs, ")"
 
-    def __repr__(self) -> str:
-        return f"{self.__class__.__name__}(rhs={repr(self.rhs)})"
+    def repr_parts(self) -> Sequence[Union[str, Expression]]:
+        return f"{self.__class__.__name__}(rhs=", self.rhs, ")"
 
 
 class Identity(UnaryOperation):
+    __slots__ = ()
+
     symbol = ""
 
     join = TruthTable(1, {
@@ -54,8 +85,14 @@ class Identity(UnaryOperation):
             (T,): T
         })
 
+    @staticmethod
+    def bitwise(rhs: Any) -> Any:
+        return rhs
+
 
 class Negation(UnaryOperation):
+    __slots__ = ()
+
     symbol = "~"
 
     join = TruthTable(1, {
@@ -63,28 +100,53 @@ class Negation(UnaryOperation):
             (T,): F
         }, symbol)
 
+    @staticmethod
+    def bitwise(rhs: Any) -> Any:
+        return ~rhs
+
 
 class BinaryOperation(Operation):
+    __slots__ = ("lhs", "rhs")
+
     symbol: str = None
 
     def __init__(self, lhs: Expression, rhs: Expression) -> None:
         self.lhs = lhs
         self.rhs = rhs
 
+    @staticmethod
+    def interning_key(lhs: Expression, rhs: Expression) -> Tuple[Hashable, ...]:
+        return lhs, rhs
+
+    @property
+    def structure(self) -> Tuple[Hashable, ...]:
+        return self.lhs, self.rhs
+
+    @property
+    def operands(self) -> Tuple[Expression, ...]:
+        return self.lhs, self.rhs
+
     @cached_property
     def truth(self) -> TruthTable:
-        table = join_tables(self.join, (self.lhs.truth, self.rhs.truth))
-        table.name = str(self)
+        table = preprocessed_truth(self)
+        if table is not None:
+            return table
+        precompute_truth(self.lhs)
+        precompute_truth(self.rhs)
+        table = join_tables(self.join, (self.lhs.truth, self.rhs.truth), self.bitwise)
+        table.name = lazy_str(self)
         return table
 
-    def __str__(self) -> str:
-        return f"({self.lhs} {self.symbol} {self.rhs})"
+    def str_parts(self) -> Sequence[Union[str, Expression]]:
+        return "(", self.lhs, f" {self.symbol} ", self.rhs, ")"
 
-    def __repr__(self) -> str:
-        return f"{self.__class__.__name__}(lhs={repr(self.lhs)}, rhs={repr(self.rhs)})"
+    def repr_parts(self) -> Sequence[Union[str, Expression]]:
+        return f"{self.__class__.__name__}(lhs=", self.lhs, ", rhs=", self.rhs, ")"
 
 
 class Conjunction(BinaryOperation):
+    __slots__ = ()
+
     symbol = "&"
 
     join = TruthTable(2, {
@@ -94,8 +156,14 @@ class Conjunction(BinaryOperation):
             (T, T): T
         }, symbol)
 
+    @staticmethod
+    def bitwise(lhs: Any, rhs: Any) -> Any:
+        return lhs & rhs
+
 
 class Disjunction(BinaryOperation):
+    __slots__ = ()
+
     symbol = "|"
 
     join = TruthTable(2, {
@@ -105,8 +173,14 @@ class Disjunction(BinaryOperation):
             (T, T): T
         }, symbol)
 
+    @staticmethod
+    def bitwise(lhs: Any, rhs: Any) -> Any:
+        return lhs | rhs
+
 
 class ExclDisjunction(BinaryOperation):
+    __slots__ = ()
+
     symbol = "+"
 
     join = TruthTable(2, {
@@ -116,8 +190,14 @@ class ExclDisjunction(BinaryOperation):
             (T, T): F
         }, symbol)
 
+    @staticmethod
+    def bitwise(lhs: Any, rhs: Any) -> Any:
+        return lhs ^ rhs
+
 
 class Implication(BinaryOperation):
+    __slots__ = ()
+
     symbol = "->"
 
     join = TruthTable(2, {
@@ -127,8 +207,14 @@ class Implication(BinaryOperation):
             (T, T): T
         }, symbol)
 
+    @staticmethod
+    def bitwise(lhs: Any, rhs: Any) -> Any:
+        return ~lhs | rhs
+
 
 class Biconditional(BinaryOperation):
+    __slots__ = ()
+
     symbol = "<->"
 
     join = TruthTable(2, {
@@ -138,6 +224,10 @@ class Biconditional(BinaryOperation):
             (T, T): T
         }, symbol)
 
+    @staticmethod
+    def bitwise(lhs: Any, rhs: Any) -> Any:
+        return ~(lhs ^ rhs)
+
 
 unary_operations = (
     Identity,
@@ -151,3 +241,37 @@ binary_operations = (
     ExclDisjunction,
     Implication
 )
+
+
+# Computes op's truth table from the expression its class's truth_preprocessor replaces it with, over op's own inputs.
+# Returns None if there is no preprocessor, or it doesn't replace op.
+def preprocessed_truth(op: Operation) -> Optional[TruthTable]:
+    preprocessor = type(op).truth_preprocessor
+    if preprocessor is None:
+        return None
+    replacement = preprocessor(op)
+    if replacement is op:
+        return None
+    table = expand_table(replacement.truth, truth_inputs(op))
+    table.name = lazy_str(op)
+    return table
+
+
+# Gets a function which computes an operation elementwise using only the &, |, ^ and ~ operators.
+# Operations without a bitwise form are expanded from their join table as a disjunction of its T rows.
+def bitwise_function(op: Operation) -> Callable[..., Any]:
+    if op.bitwise is not None:
+        return op.bitwise
+    arity = len(op.operands)
+    true_rows = [row for row in product((F, T), repeat=arity) if op.join[row]]
+
+    def bitwise(*operands: Any) -> Any:
+        result = operands[0] & ~operands[0]
+        for row in true_rows:
+            term = ~result | result
+            for operand, value in zip(operands, row):
+                term = term & (operand if value else ~operand)
+            result = result | term
+        return result
+
+    return bitwise
@@ -0,0 +1,459 @@
+from boolean import BooleanValue, F, T
+from expression import Expression, Literal, postorder, TruthTableEngine, Variable
+from operation import Operation
+from truthtable import TruthTable
+
+import heapq
+from itertools import combinations, product
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, TextIO, Tuple, Union
+from weakref import WeakKeyDictionary
+
+
+__all__ = [
+    "CNF",
+    "encode",
+    "SATEngine",
+    "Solver",
+    "tseitin"
+]
+
+
+# A formula in conjunctive normal form, using DIMACS conventions: variables are numbered from 1, and a literal is a
+# variable number, negated if the variable is F.
+class CNF:
+    def __init__(self, num_vars: int = 0, clauses: Optional[Iterable[Sequence[int]]] = None, names: Optional[Dict[str, int]] = None) -> None:
+        self.num_vars = num_vars
+        self.clauses: List[List[int]] = [] if clauses is None else [list(clause) for clause in clauses]
+        # Maps expression variable names to CNF variables.
+        self.names: Dict[str, int] = {} if names is None else dict(names)
+
+    def new_var(self) -> int:
+        self.num_vars += 1
+        return self.num_vars
+
+    def add_clause(self, clause: Sequence[int]) -> None:
+        self.clauses.append(list(clause))
+
+    # Converts a model of this CNF to an assignment of the expression variables.
+    def assignment(self, model: Dict[int, bool]) -> Dict[str, BooleanValue]:
+        return {name: T if model[var] else F for name, var in self.names.items()}
+
+    def to_dimacs(self) -> str:
+        lines = [f"c var {var} {name}" for name, var in self.names.items()]
+        lines.append(f"p cnf {self.num_vars} {len(self.clauses)}")
+        lines.extend(" ".join(map(str, clause)) + " 0" for clause in self.clauses)
+        return "\n".join(lines) + "\n"
+
+    def write_dimacs(self, file: TextIO) -> None:
+        file.write(self.to_dimacs())
+
+    @classmethod
+    def from_dimacs(cls, text: str) -> "CNF":
+        cnf = cls()
+        declared_vars = None
+        clause: List[int] = []
+        for line_num, line in enumerate(text.splitlines(), 1):
+            fields = line.split()
+            if not fields or fields[0] == "%":
+                continue
+            if fields[0] == "c":
+                if len(fields) == 4 and fields[1] == "var":
+                    cnf.names[fields[3]] = int(fields[2])
+                continue
+            if fields[0] == "p":
+                if len(fields) != 4 or fields[1] != "cnf":
+                    raise ValueError(f"Invalid problem line on line {line_num}.")
+                declared_vars = int(fields[2])
+                continue
+            try:
+                lits = [int(field) for field in fields]
+            except ValueError:
+                raise ValueError(f"Invalid clause on line {line_num}.")
+            for lit in lits:
+                if lit == 0:
+                    cnf.add_clause(clause)
+                    clause = []
+                else:
+                    clause.append(lit)
+                    cnf.num_vars = max(cnf.num_vars, abs(lit))
+        if clause:
+            cnf.add_clause(clause)
+        if declared_vars is not None:
+            cnf.num_vars = max(cnf.num_vars, declared_vars)
+        return cnf
+
+    @classmethod
+    def read_dimacs(cls, file: TextIO) -> "CNF":
+        return cls.from_dimacs(file.read())
+
+
+# Tseitin encodes an expression: each distinct subexpression gets a CNF variable, constrained to equal the
+# subexpression's value. Returns the CNF and the literal for the whole expression.
+def tseitin(expr: Expression) -> Tuple[CNF, int]:
+    cnf = CNF()
+    lits: Dict[Expression, int] = {}
+    for subexpr in postorder(expr):
+        if isinstance(subexpr, Variable):
+            lit = cnf.names.get(subexpr.name)
+            if lit is None:
+                lit = cnf.new_var()
+                cnf.names[subexpr.name] = lit
+        elif isinstance(subexpr, Literal):
+            lit = cnf.new_var()
+            cnf.add_clause((lit if subexpr.value else -lit,))
+        elif isinstance(subexpr, Operation):
+            gate_lits = [lits[operand] for operand in subexpr.operands]
+            lit = cnf.new_var()
+            gate_lits.append(lit)
+            for clause in gate_clauses(subexpr.join, len(subexpr.operands)):
+                cnf.add_clause([gate_lits[i] if value else -gate_lits[i] for i, value in clause])
+        else:
+            raise TypeError(f"Can't encode `{type(subexpr)}`.")
+        lits[subexpr] = lit
+    return cnf, lits[expr]
+
+
+gate_clause_cache: Dict[TruthTable, List[Tuple[Tuple[int, bool], ...]]] = {}
+
+
+# Finds the prime implicates of "output == join(operands)", as clauses of (position, value) pairs where position
+# arity is the output. Using prime implicates, rather than one clause per row of the join table, means unit propagation
+# alone derives everything the gate implies, e.g. that both operands of a true conjunction are true.
+def gate_clauses(join: TruthTable, arity: int) -> List[Tuple[Tuple[int, bool], ...]]:
+    clauses = gate_clause_cache.get(join)
+    if clauses is None:
+        rows = [tuple(map(bool, row + (join[row],))) for row in product((F, T), repeat=arity)]
+        clauses = []
+        for size in range(1, arity + 2):
+            for positions in combinations(range(arity + 1), size):
+                for values in product((False, True), repeat=size):
+                    clause = tuple(zip(positions, values))
+                    implied = all(any(row[i] == value for i, value in clause) for row in rows)
+                    subsumed = any(set(c) <= set(clause) for c in clauses)
+                    if implied and not subsumed:
+                        clauses.append(clause)
+        gate_clause_cache[join] = clauses
+    return clauses
+
+
+# Encodes "expr evaluates to value" as a CNF, which is satisfiable exactly when expr could be value.
+def encode(expr: Expression, value: BooleanValue) -> CNF:
+    cnf, lit = tseitin(expr)
+    cnf.add_clause((lit if value else -lit,))
+    return cnf
+
+
+# A conflict-driven clause learning SAT solver, with two watched literals, first-UIP clause learning, VSIDS branching,
+# phase saving and Luby restarts.
+# Internally, the literal for variable v (numbered from 0) is 2v if positive and 2v + 1 if negative.
+class Solver:
+    restart_base = 100
+    var_decay = 0.95
+
+    def __init__(self, cnf: Optional[CNF] = None) -> None:
+        self.num_vars = 0
+        self.clauses: List[List[int]] = []
+        self.units: List[int] = []
+        self.watches: List[List[int]] = []
+        # Per variable: None if unassigned, else 0 (F) or 1 (T).
+        self.assigns: List[Optional[int]] = []
+        self.levels: List[int] = []
+        self.reasons: List[Optional[int]] = []
+        self.activity: List[float] = []
+        self.phase: List[int] = []
+        self.trail: List[int] = []
+        self.trail_lim: List[int] = []
+        self.qhead = 0
+        self.order: List[Tuple[float, int]] = []
+        self.var_inc = 1.0
+        # False once the clauses are known to be unsatisfiable.
+        self.ok = True
+        self.conflicts = 0
+        if cnf is not None:
+            self.ensure_vars(cnf.num_vars)
+            for clause in cnf.clauses:
+                self.add_clause(clause)
+            # Branch on expression variables first. Tseitin variables are then mostly fixed by propagation.
+            for var in cnf.names.values():
+                self.activity[var - 1] = self.var_inc
+            self.order = [(-activity, var) for var, activity in enumerate(self.activity)]
+            heapq.heapify(self.order)
+
+    def ensure_vars(self, num_vars: int) -> None:
+        while self.num_vars < num_vars:
+            self.num_vars += 1
+            self.watches.append([])
+            self.watches.append([])
+            self.assigns.append(None)
+            self.levels.append(0)
+            self.reasons.append(None)
+            self.activity.append(0.0)
+            self.phase.append(0)
+            heapq.heappush(self.order, (0.0, self.num_vars - 1))
+
+    # Adds a clause of DIMACS literals.
+    def add_clause(self, clause: Sequence[int]) -> None:
+        self.ensure_vars(max((abs(lit) for lit in clause), default=0))
+        lits = sorted(set(self.from_dimacs(lit) for lit in clause))
+        if any(lit ^ 1 in lits for lit in lits):
+            return
+        if not lits:
+            self.ok = False
+        elif len(lits) == 1:
+            self.units.append(lits[0])
+        else:
+            self.attach(lits)
+
+    # Solves the clauses, with the given DIMACS literals assumed true.
+    # Returns a model as a map from DIMACS variable to value, or None if unsatisfiable.
+    def solve(self, assumptions: Sequence[int] = ()) -> Optional[Dict[int, bool]]:
+        if not self.ok:
+            return None
+        assumptions = [self.from_dimacs(lit) for lit in assumptions]
+        self.ensure_vars(max((lit >> 1) + 1 for lit in assumptions) if assumptions else 0)
+        try:
+            for lit in self.units:
+                if self.enqueue(lit, None) is None:
+                    self.ok = False
+                    return None
+            restarts = 0
+            while True:
+                conflict_limit = self.restart_base * luby(restarts)
+                result = self.search(assumptions, conflict_limit)
+                if result is False:
+                    return None
+                elif result is not None:
+                    return result
+                restarts += 1
+        finally:
+            self.backtrack(0)
+
+    # Runs CDCL until a model is found (returned), unsatisfiability is proven (returns False), or conflict_limit
+    # conflicts have happened (returns None to request a restart).
+    def search(self, assumptions: Sequence[int], conflict_limit: int) -> Union[Dict[int, bool], bool, None]:
+        conflicts = 0
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                conflicts += 1
+                if self.decision_level == 0:
+                    self.ok = False
+                    return False
+                learnt, backjump_level = self.analyze(conflict)
+                self.backtrack(backjump_level)
+                if len(learnt) == 1:
+                    self.units.append(learnt[0])
+                    self.enqueue(learnt[0], None)
+                else:
+                    self.enqueue(learnt[0], self.attach(learnt))
+                self.decay_activity()
+            else:
+                if conflicts >= conflict_limit:
+                    self.backtrack(0)
+                    return None
+                if self.decision_level < len(assumptions):
+                    lit = assumptions[self.decision_level]
+                    value = self.value(lit)
+                    if value == 0:
+                        return False
+                    self.trail_lim.append(len(self.trail))
+                    if value is None:
+                        self.enqueue(lit, None)
+                    continue
+                var = self.pick_branch_var()
+                if var is None:
+                    return {var + 1: bool(value) for var, value in enumerate(self.assigns)}
+                self.trail_lim.append(len(self.trail))
+                self.enqueue(2 * var + (1 - self.phase[var]), None)
+
+    @property
+    def decision_level(self) -> int:
+        return len(self.trail_lim)
+
+    @staticmethod
+    def from_dimacs(lit: int) -> int:
+        if lit == 0:
+            raise ValueError("0 is not a valid literal.")
+        return 2 * (abs(lit) - 1) + (lit < 0)
+
+    def value(self, lit: int) -> Optional[int]:
+        value = self.assigns[lit >> 1]
+        if value is None:
+            return None
+        return value ^ (lit & 1)
+
+    def attach(self, lits: List[int]) -> int:
+        index = len(self.clauses)
+        self.clauses.append(lits)
+        self.watches[lits[0]].append(index)
+        self.watches[lits[1]].append(index)
+        return index
+
+    # Assigns lit true. Returns lit, or None if it was already false.
+    def enqueue(self, lit: int, reason: Optional[int]) -> Optional[int]:
+        value = self.value(lit)
+        if value is not None:
+            return lit if value else None
+        var = lit >> 1
+        self.assigns[var] = 1 - (lit & 1)
+        self.levels[var] = self.decision_level
+        self.reasons[var] = reason
+        self.trail.append(lit)
+        return lit
+
+    # Unit propagates assignments on the trail. Returns the index of a conflicting clause, if there is one.
+    # The implied literal of a reason clause is always its first literal.
+    def propagate(self) -> Optional[int]:
+        clauses = self.clauses
+        watches = self.watches
+        assigns = self.assigns
+        while self.qhead < len(self.trail):
+            false_lit = self.trail[self.qhead] ^ 1
+            self.qhead += 1
+            watchers = watches[false_lit]
+            i = j = 0
+            while i < len(watchers):
+                index = watchers[i]
+                i += 1
+                clause = clauses[index]
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+                first = clause[0]
+                first_value = assigns[first >> 1]
+                if first_value is not None and first_value ^ (first & 1):
+                    watchers[j] = index
+                    j += 1
+                    continue
+                for k in range(2, len(clause)):
+                    lit = clause[k]
+                    value = assigns[lit >> 1]
+                    if value is None or value ^ (lit & 1):
+                        clause[1], clause[k] = lit, false_lit
+                        watches[lit].append(index)
+                        break
+                else:
+                    watchers[j] = index
+                    j += 1
+                    if first_value is not None:
+                        while i < len(watchers):
+                            watchers[j] = watchers[i]
+                            j += 1
+                            i += 1
+                        del watchers[j:]
+                        return index
+                    self.enqueue(first, index)
+            del watchers[j:]
+        return None
+
+    # Derives a first-UIP learnt clause from a conflict. Returns the clause, with the asserting literal first and a
+    # literal from the backjump level second, and the level to backjump to.
+    def analyze(self, conflict: int) -> Tuple[List[int], int]:
+        seen = set()
+        learnt = [0]
+        counter = 0
+        lit = None
+        index = len(self.trail) - 1
+        clause = self.clauses[conflict]
+        while True:
+            for q in (clause if lit is None else clause[1:]):
+                var = q >> 1
+                if var not in seen and self.levels[var] > 0:
+                    seen.add(var)
+                    self.bump_activity(var)
+                    if self.levels[var] >= self.decision_level:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while (self.trail[index] >> 1) not in seen:
+                index -= 1
+            lit = self.trail[index]
+            index -= 1
+            counter -= 1
+            if counter == 0:
+                break
+            clause = self.clauses[self.reasons[lit >> 1]]
+        learnt[0] = lit ^ 1
+
+        if len(learnt) == 1:
+            return learnt, 0
+        highest = max(range(1, len(learnt)), key=lambda i: self.levels[learnt[i] >> 1])
+        learnt[1], learnt[highest] = learnt[highest], learnt[1]
+        return learnt, self.levels[learnt[1] >> 1]
+
+    def backtrack(self, level: int) -> None:
+        if self.decision_level <= level:
+            return
+        start = self.trail_lim[level]
+        for lit in self.trail[start:]:
+            var = lit >> 1
+            self.phase[var] = self.assigns[var]
+            self.assigns[var] = None
+            self.reasons[var] = None
+            heapq.heappush(self.order, (-self.activity[var], var))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = min(self.qhead, start)
+
+    def pick_branch_var(self) -> Optional[int]:
+        while self.order:
+            activity, var = heapq.heappop(self.order)
+            if self.assigns[var] is None and -activity == self.activity[var]:
+                return var
+        # Stale heap entries may have hidden some variables.
+        for var, value in enumerate(self.assigns):
+            if value is None:
+                return var
+        return None
+
+    def bump_activity(self, var: int) -> None:
+        self.activity[var] += self.var_inc
+        if self.activity[var] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self.order = [(-a, v) for v, a in enumerate(self.activity) if self.assigns[v] is None]
+            heapq.heapify(self.order)
+        elif self.assigns[var] is None:
+            heapq.heappush(self.order, (-self.activity[var], var))
+
+    def decay_activity(self) -> None:
+        self.var_inc /= self.var_decay
+
+
+# The i-th element (from 0) of the Luby sequence: 1, 1, 2, 1, 1, 2, 4, ...
+def luby(i: int) -> int:
+    size = 1
+    exponent = 0
+    while size < i + 1:
+        size = 2 * size + 1
+        exponent += 1
+    while size - 1 != i:
+        size = (size - 1) // 2
+        exponent -= 1
+        i %= size
+    return 2 ** exponent
+
+
+# Answers questions about expressions with the SAT solver, so only needs to handle one model at a time.
+# Suits wide expressions where only satisfiability, validity and witnesses are needed.
+class SATEngine(TruthTableEngine):
+    def __init__(self) -> None:
+        self.encodings: "WeakKeyDictionary[Expression, Tuple[CNF, int, Solver]]" = WeakKeyDictionary()
+
+    def encoding(self, expr: Expression) -> Tuple[CNF, int, Solver]:
+        encoding = self.encodings.get(expr)
+        if encoding is None:
+            cnf, lit = tseitin(expr)
+            encoding = cnf, lit, Solver(cnf)
+            self.encodings[expr] = encoding
+        return encoding
+
+    def values(self, expr: Expression) -> FrozenSet[BooleanValue]:
+        return frozenset(value for value in (F, T) if self.find_assignment(expr, value) is not None)
+
+    def find_assignment(self, expr: Expression, value: BooleanValue) -> Optional[Dict[str, BooleanValue]]:
+        cnf, lit, solver = self.encoding(expr)
+        model = solver.solve((lit if value else -lit,))
+        if model is None:
+            return None
+        return cnf.assignment(model)
@@ -0,0 +1,123 @@
+from boolean import BooleanValue, F, T
+from expression import Expression, Literal, literal_f, literal_t
+from operation import BinaryOperation, Conjunction, Disjunction, Negation, Operation, UnaryOperation
+
+from typing import Callable, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+
+__all__ = [
+    "auto_simplify",
+    "simplify"
+]
+
+
+# Maps expressions to their simplified form, or None if they are already simplified.
+simplified_expressions: "WeakKeyDictionary[Expression, Optional[Expression]]" = WeakKeyDictionary()
+
+
+# Simplifies expr into an equivalent expression, by constant folding and rewrite rules applied to every subexpression
+# until none applies. The rules are derived from the operations' join tables where possible:
+#  - an operation with a literal operand is replaced by a literal, its other operand, or that operand's negation.
+#  - likewise for a binary operation on an operand and itself or its negation, as in (x & x) or (x + ~x).
+#  - a unary operation of a unary operation, as in ~~x or Identity(x), is replaced likewise.
+#  - absorption: (x & (x | y)) and (x | (x & y)) become x.
+# The result never depends on variables expr doesn't depend on, but may no longer mention variables expr does.
+def simplify(expr: Expression) -> Expression:
+    stack = [(expr, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if node in simplified_expressions:
+            continue
+        if expanded or not isinstance(node, Operation):
+            result = simplify_node(node)
+            if result is node:
+                simplified_expressions[node] = None
+            else:
+                simplified_expressions[node] = result
+                simplified_expressions[result] = None
+        else:
+            stack.append((node, True))
+            stack.extend((operand, False) for operand in node.operands)
+    return simplified(expr)
+
+
+def simplified(expr: Expression) -> Expression:
+    result = simplified_expressions[expr]
+    return expr if result is None else result
+
+
+# Simplifies expr, whose operands have already been simplified.
+def simplify_node(expr: Expression) -> Expression:
+    if isinstance(expr, Operation):
+        operands = tuple(simplified(operand) for operand in expr.operands)
+        if any(new is not old for new, old in zip(operands, expr.operands)):
+            expr = type(expr)(*operands)
+    while True:
+        rewritten = rewrite(expr)
+        if rewritten is None:
+            return expr
+        expr = rewritten
+
+
+# Applies one rule to expr, whose operands are simplified. Returns None if no rule applies.
+def rewrite(expr: Expression) -> Optional[Expression]:
+    if isinstance(expr, UnaryOperation):
+        rhs = expr.rhs
+        if isinstance(rhs, Literal):
+            return literal(expr.join[(rhs.value,)])
+        result = function_of(lambda x: expr.join[(x,)], rhs)
+        if result is not expr:
+            return result
+        if isinstance(rhs, UnaryOperation):
+            return function_of(lambda x: expr.join[(rhs.join[(x,)],)], rhs.rhs)
+
+    elif isinstance(expr, BinaryOperation):
+        lhs, rhs = expr.lhs, expr.rhs
+        if isinstance(lhs, Literal):
+            return function_of(lambda x: expr.join[(lhs.value, x)], rhs)
+        if isinstance(rhs, Literal):
+            return function_of(lambda x: expr.join[(x, rhs.value)], lhs)
+        if lhs is rhs:
+            return function_of(lambda x: expr.join[(x, x)], lhs)
+        if is_negation_of(lhs, rhs):
+            return function_of(lambda x: expr.join[(negate(x), x)], rhs)
+        if is_negation_of(rhs, lhs):
+            return function_of(lambda x: expr.join[(x, negate(x))], lhs)
+        if isinstance(expr, (Conjunction, Disjunction)):
+            inner = Disjunction if isinstance(expr, Conjunction) else Conjunction
+            if isinstance(rhs, inner) and lhs in (rhs.lhs, rhs.rhs):
+                return lhs
+            if isinstance(lhs, inner) and rhs in (lhs.lhs, lhs.rhs):
+                return rhs
+
+    return None
+
+
+# Expresses the unary function f applied to x as the simplest expression: a literal, x, or ~x.
+def function_of(f: Callable[[BooleanValue], BooleanValue], x: Expression) -> Expression:
+    values: Tuple[BooleanValue, BooleanValue] = (f(F), f(T))
+    if values[0] == values[1]:
+        return literal(values[0])
+    elif values == (F, T):
+        return x
+    else:
+        return Negation(x)
+
+
+def is_negation_of(expr: Expression, other: Expression) -> bool:
+    return isinstance(expr, Negation) and expr.rhs is other
+
+
+def literal(value: BooleanValue) -> Literal:
+    return literal_t if value else literal_f
+
+
+def negate(value: BooleanValue) -> BooleanValue:
+    return F if value else T
+
+
+# Sets whether operations simplify themselves before computing their truth table. Truth tables stay the same, including
+# their inputs, but are computed from the simplified expression.
+def auto_simplify(enabled: bool = True) -> None:
+    Operation.truth_preprocessor = simplify if enabled else None
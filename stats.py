@@ -0,0 +1,102 @@
+from collections import defaultdict
+from functools import wraps
+import time
+from typing import Any, Callable, DefaultDict, Dict, List, TypeVar
+
+
+__all__ = [
+    "add_time",
+    "enable",
+    "format_stats",
+    "increment",
+    "merge",
+    "reset",
+    "snapshot",
+    "timed"
+]
+
+
+# Whether statistics are being collected. Off by default; instrumented code checks it before doing any work, or is
+# swapped for an instrumented version by enable().
+enabled = False
+
+# Counts of events, by name.
+counters: DefaultDict[str, int] = defaultdict(int)
+
+# Number of calls and total seconds of timed functions, by name.
+timers: DefaultDict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+Function = TypeVar("Function", bound=Callable[..., Any])
+
+
+# Starts or stops collecting statistics. Statistics collected so far are kept.
+def enable(enable: bool = True) -> None:
+    global enabled
+    enabled = enable
+    # cached_property is too hot to check enabled on every access.
+    import utility
+    utility.cached_property.__get__ = utility.cached_property.counting_get if enable else utility.cached_property.plain_get
+
+
+def reset() -> None:
+    counters.clear()
+    timers.clear()
+
+
+def increment(name: str, amount: int = 1) -> None:
+    counters[name] += amount
+
+
+def add_time(name: str, seconds: float) -> None:
+    timer = timers[name]
+    timer[0] += 1
+    timer[1] += seconds
+
+
+# Decorator which times calls to a function under name while statistics are enabled.
+def timed(name: str) -> Callable[[Function], Function]:
+    def decorator(function: Function) -> Function:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# The statistics collected so far, as plain data which can be pickled or saved as JSON.
+def snapshot() -> Dict[str, Any]:
+    return {
+        "counters": dict(counters),
+        "timers": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in timers.items()}
+    }
+
+
+# Adds statistics from a snapshot, such as one taken in another process.
+def merge(stats: Dict[str, Any]) -> None:
+    for name, count in stats["counters"].items():
+        counters[name] += count
+    for name, timer in stats["timers"].items():
+        total = timers[name]
+        total[0] += timer["calls"]
+        total[1] += timer["seconds"]
+
+
+# Formats the statistics collected so far as a table.
+def format_stats() -> str:
+    lines = []
+    if counters:
+        lines.append(f"{'Counter':<40} {'Count':>14}")
+        lines.extend(f"{name:<40} {count:>14}" for name, count in sorted(counters.items()))
+    if timers:
+        if lines:
+            lines.append("")
+        lines.append(f"{'Timer':<40} {'Calls':>14} {'Total (s)':>12} {'Mean (us)':>12}")
+        for name, (calls, seconds) in sorted(timers.items()):
+            lines.append(f"{name:<40} {calls:>14} {seconds:>12.3f} {seconds / calls * 1e6 if calls else 0:>12.1f}")
+    return "\n".join(lines) if lines else "No statistics collected."
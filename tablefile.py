@@ -0,0 +1,104 @@
+from boolean import F, T
+from expression import Variable
+from truthtable import Input, PackedTruthTable, TruthTable
+
+import json
+import struct
+from typing import Any, Dict, List
+
+import numpy
+
+
+__all__ = [
+    "load_table",
+    "save_table",
+    "TableFormatError"
+]
+
+
+class TableFormatError(Exception):
+    pass
+
+
+# Truth table files are:
+#  - the magic bytes, then the format version and the length of the header, as little-endian uint32s.
+#  - the header: UTF-8 JSON giving the table's name, number of rows, and inputs (each with its tag and values).
+#  - padding to a multiple of 8 bytes, then the output column packed as by truthtable.pack_column(), as little-endian
+#    uint64 words.
+table_magic = b"TRUTHTBL"
+table_version = 1
+table_prefix = struct.Struct("<8sII")
+
+
+def input_to_json(input_: Input) -> Dict[str, Any]:
+    tag = input_.tag
+    if isinstance(tag, Variable):
+        kind = "variable"
+        tag_name = tag.name
+    elif tag is F or tag is T:
+        kind = "literal"
+        tag_name = str(tag)
+    else:
+        kind = "tag"
+        tag_name = str(tag)
+    return {"kind": kind, "tag": tag_name, "values": "".join(str(value) for value in (F, T) if value in input_.values)}
+
+
+def input_from_json(data: Dict[str, Any]) -> Input:
+    values = {value for value in (F, T) if str(value) in data["values"]}
+    if data["kind"] == "variable":
+        return Input(Variable(data["tag"]), values)
+    elif data["kind"] == "literal":
+        return Input(T if data["tag"] == str(T) else F, values)
+    else:
+        return Input(Input.UniqueTag(data["tag"]), values)
+
+
+# Saves a truth table to a file.
+def save_table(table: TruthTable, path: str) -> None:
+    if not isinstance(table, PackedTruthTable):
+        table = PackedTruthTable.from_table(table)
+    header = json.dumps({
+        "name": table.name,
+        "num_rows": table.num_rows,
+        "inputs": [input_to_json(i) for i in table.inputs]
+    }).encode("utf-8")
+    padding = -(table_prefix.size + len(header)) % 8
+    with open(path, mode="wb") as file:
+        file.write(table_prefix.pack(table_magic, table_version, len(header)))
+        file.write(header)
+        file.write(bytes(padding))
+        numpy.asarray(table.bits, dtype="<u8").tofile(file)
+
+
+# Loads a truth table saved by save_table(). The output column is memory-mapped read-only rather than read, so loading
+# takes constant time, and processes loading the same file share its pages. Lookups only read the words they need.
+def load_table(path: str) -> PackedTruthTable:
+    with open(path, mode="rb") as file:
+        prefix = file.read(table_prefix.size)
+        if len(prefix) != table_prefix.size:
+            raise TableFormatError("Not a truth table file.")
+        magic, version, header_size = table_prefix.unpack(prefix)
+        if magic != table_magic:
+            raise TableFormatError("Not a truth table file.")
+        if version != table_version:
+            raise TableFormatError(f"Unsupported truth table file version {version}.")
+        try:
+            header = json.loads(file.read(header_size).decode("utf-8"))
+            inputs: List[Input] = [input_from_json(i) for i in header["inputs"]]
+            name = header["name"]
+            num_rows = header["num_rows"]
+        except (ValueError, KeyError, TypeError):
+            raise TableFormatError("Invalid truth table header.")
+
+    table = PackedTruthTable(inputs, numpy.empty(0, dtype=numpy.uint64), name)
+    if table.num_rows != num_rows:
+        raise TableFormatError("Number of rows doesn't match the inputs.")
+    offset = table_prefix.size + header_size
+    offset += -offset % 8
+    num_words = (num_rows + 63) // 64
+    try:
+        table.bits = numpy.memmap(path, dtype="<u8", mode="r", offset=offset, shape=(num_words,))
+    except ValueError:
+        raise TableFormatError("Truth table file is truncated.")
+    return table
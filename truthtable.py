@@ -1,19 +1,33 @@
 from boolean import BooleanValue, F, T
+import stats
 
 from itertools import product
-from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Sequence, Set, Tuple, Union
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+import numpy
 
 
 __all__ = [
+    "expand_table",
     "Input",
+    "input_values",
     "join_tables",
+    "MappingTruthTable",
+    "pack_column",
+    "PackedTruthTable",
+    "popcount",
     "TruthTable",
+    "unpack_column",
     "value_combinations"
 ]
 
 
 class Input:
+    __slots__ = ("tag", "values")
+
     class UniqueTag:
+        __slots__ = ("value",)
+
         def __init__(self, value: Any) -> None:
             self.value = value
 
@@ -37,14 +51,25 @@ class Input:
         return isinstance(other, Input) and self.tag == other.tag
 
 
+# name may be given as a function returning the name, which is called when the name is first needed. That saves
+# building names for the tables of every subexpression, which takes quadratic time for deep expressions.
+# Subclasses store the output column in their own way. Constructing TruthTable itself makes a MappingTruthTable, so the
+# other subclasses don't carry an unused slot for a mapping.
 class TruthTable:
-    def __init__(self, inputs: Union[Sequence[Input], int], table: Mapping[Tuple[BooleanValue, ...], BooleanValue], name: Optional[str] = None) -> None:
-        if isinstance(inputs, int):
-            self.inputs = tuple(Input.UniqueTag(f"<{i + 1}>") for i in range(inputs))
-        else:
-            self.inputs = inputs
-        self.table = table
-        self.name = name
+    __slots__ = ("inputs", "_name")
+
+    def __new__(cls, *args, **kwargs) -> "TruthTable":
+        return super().__new__(MappingTruthTable if cls is TruthTable else cls)
+
+    @property
+    def name(self) -> Optional[str]:
+        if callable(self._name):
+            self._name = self._name()
+        return self._name
+
+    @name.setter
+    def name(self, name: Optional[Union[str, Callable[[], str]]]) -> None:
+        self._name = name
 
     @property
     def outputs(self) -> FrozenSet[BooleanValue]:
@@ -54,16 +79,24 @@ class TruthTable:
     def distribution(self) -> Dict[BooleanValue, float]:
         return {value: sum(1 for v in self.table.values() if v == value) / len(self.table) for value in (F, T)}
 
+    # Counts the number of rows which output value.
+    def count(self, value: BooleanValue) -> int:
+        return sum(1 for v in self.table.values() if v == value)
+
     def __getitem__(self, inputs: Tuple[BooleanValue, ...]) -> BooleanValue:
         return self.table[inputs]
 
+    # Iterates over the (inputs, output) rows of the table.
+    def items(self) -> Iterator[Tuple[Tuple[BooleanValue, ...], BooleanValue]]:
+        return iter(self.table.items())
+
     def print(self) -> None:
         in_divider = " | "
         out_divider = " || "
         headers = [str(i.tag) for i in self.inputs]
         header = in_divider.join(headers) + out_divider + ("<out>" if self.name is None else self.name)
         print(header)
-        for inputs, output in self.table.items():
+        for inputs, output in self.items():
             cols: List[str] = []
             for i, value in enumerate(inputs):
                 s = str(value)
@@ -73,7 +106,133 @@ class TruthTable:
             print(row)
 
 
-def join_tables(join_op: TruthTable, tables: Sequence[TruthTable]) -> TruthTable:
+# A truth table which stores its rows in a mapping from inputs to output.
+class MappingTruthTable(TruthTable):
+    __slots__ = ("table",)
+
+    def __init__(self, inputs: Union[Sequence[Input], int], table: Mapping[Tuple[BooleanValue, ...], BooleanValue], name: Optional[Union[str, Callable[[], str]]] = None) -> None:
+        if isinstance(inputs, int):
+            self.inputs = tuple(Input(Input.UniqueTag(f"<{i + 1}>")) for i in range(inputs))
+        else:
+            self.inputs = inputs
+        self.table = table
+        self.name = name
+
+
+# A truth table which stores its output column as packed bits rather than a dict.
+# Rows are numbered in value_combinations() order, and row i is bit (i % 64) of word (i // 64) of bits, where a set bit
+# means T. Bits past the last row are always 0.
+class PackedTruthTable(TruthTable):
+    __slots__ = ("bits",)
+
+    def __init__(self, inputs: Sequence[Input], bits: numpy.ndarray, name: Optional[Union[str, Callable[[], str]]] = None) -> None:
+        self.inputs = tuple(inputs)
+        self.bits = bits
+        self.name = name
+
+    @classmethod
+    def from_column(cls, inputs: Sequence[Input], column: Iterable[Union[bool, BooleanValue]], name: Optional[Union[str, Callable[[], str]]] = None) -> "PackedTruthTable":
+        column = numpy.fromiter(map(bool, column), dtype=bool)
+        return cls(inputs, pack_column(column), name)
+
+    @classmethod
+    def from_table(cls, table: TruthTable) -> "PackedTruthTable":
+        return cls.from_column(table.inputs, (table[inputs] for inputs in value_combinations(table.inputs)), table.name)
+
+    @property
+    def num_rows(self) -> int:
+        num_rows = 1
+        for i in self.inputs:
+            num_rows *= len(i.values)
+        return num_rows
+
+    @property
+    def column(self) -> numpy.ndarray:
+        return unpack_column(self.bits, self.num_rows)
+
+    @property
+    def table(self) -> Dict[Tuple[BooleanValue, ...], BooleanValue]:
+        return dict(self.items())
+
+    @property
+    def outputs(self) -> FrozenSet[BooleanValue]:
+        num_true = self.count(T)
+        outputs = set()
+        if num_true > 0:
+            outputs.add(T)
+        if num_true < self.num_rows:
+            outputs.add(F)
+        return frozenset(outputs)
+
+    @property
+    def distribution(self) -> Dict[BooleanValue, float]:
+        num_rows = self.num_rows
+        num_true = self.count(T)
+        return {F: (num_rows - num_true) / num_rows, T: num_true / num_rows}
+
+    def count(self, value: BooleanValue) -> int:
+        num_true = popcount(self.bits)
+        return num_true if value else self.num_rows - num_true
+
+    def row_index(self, inputs: Tuple[BooleanValue, ...]) -> int:
+        if len(inputs) != len(self.inputs):
+            raise KeyError(inputs)
+        index = 0
+        for i, value in zip(self.inputs, inputs):
+            values = input_values(i)
+            try:
+                digit = values.index(value)
+            except ValueError:
+                raise KeyError(inputs)
+            index = index * len(values) + digit
+        return index
+
+    def __getitem__(self, inputs: Tuple[BooleanValue, ...]) -> BooleanValue:
+        index = self.row_index(inputs)
+        bit = (int(self.bits[index >> 6]) >> (index & 63)) & 1
+        return T if bit else F
+
+    def items(self) -> Iterator[Tuple[Tuple[BooleanValue, ...], BooleanValue]]:
+        column = self.column
+        for inputs, bit in zip(value_combinations(self.inputs), column):
+            yield inputs, T if bit else F
+
+
+# Joins tables together by applying join_op to their outputs, over the union of their inputs.
+# If bitwise is given, it must compute join_op elementwise over boolean NumPy arrays (using &, |, ^ and ~), and the join
+# is done on whole columns at once. Otherwise join_op is looked up row by row.
+@stats.timed("truthtable.join_tables")
+def join_tables(join_op: TruthTable, tables: Sequence[TruthTable], bitwise: Optional[Callable[..., numpy.ndarray]] = None) -> PackedTruthTable:
+    res_vars, input_var_indices = merge_inputs(tables)
+    if stats.enabled:
+        num_rows = 1
+        for var in res_vars:
+            num_rows *= len(var.values)
+        stats.increment("truthtable.join_tables.rows", num_rows)
+        if bitwise is None:
+            stats.increment("truthtable.join_tables.rowwise")
+    if bitwise is None:
+        return join_tables_rowwise(join_op, tables, res_vars, input_var_indices)
+
+    res_shape = tuple(len(var.values) for var in res_vars)
+    columns = tuple(broadcast_column(table, indices, res_shape) for table, indices in zip(tables, input_var_indices))
+    res_column = numpy.broadcast_to(bitwise(*columns), res_shape)
+    return PackedTruthTable(res_vars, pack_column(res_column.ravel()))
+
+
+def join_tables_rowwise(join_op: TruthTable, tables: Sequence[TruthTable], res_vars: Sequence[Input], input_var_indices: Sequence[Sequence[int]]) -> PackedTruthTable:
+    res_column: List[BooleanValue] = []
+    for new_inputs in value_combinations(res_vars):
+        base_inputs = (tuple(new_inputs[i] for i in indices) for indices in input_var_indices)
+        base_outputs = tuple(tt[inputs] for tt, inputs in zip(tables, base_inputs))
+        output = join_op[base_outputs]
+        res_column.append(output)
+
+    return PackedTruthTable.from_column(res_vars, res_column)
+
+
+# Finds the union of the tables' inputs, in order of first occurrence, and the position of each table's inputs within it.
+def merge_inputs(tables: Sequence[TruthTable]) -> Tuple[Tuple[Input, ...], List[List[int]]]:
     input_vars = tuple(table.inputs for table in tables)
 
     input_var_indices: List[List[int]] = [[] for _ in input_vars]
@@ -86,15 +245,79 @@ def join_tables(join_op: TruthTable, tables: Sequence[TruthTable]) -> TruthTable
                 res_vars.append(var)
                 indices.append(len(res_vars) - 1)
 
-    res_tt: Dict[Tuple[BooleanValue, ...], BooleanValue] = {}
-    for new_inputs in value_combinations(res_vars):
-        base_inputs = (tuple(new_inputs[i] for i in indices) for indices in input_var_indices)
-        base_outputs = tuple(tt[inputs] for tt, inputs in zip(tables, base_inputs))
-        output = join_op[base_outputs]
-        res_tt[new_inputs] = output
+    return tuple(res_vars), input_var_indices
+
+
+# Views a table's output column as a boolean array which broadcasts against res_shape, where indices gives the axis of
+# res_shape corresponding to each of the table's inputs.
+def broadcast_column(table: TruthTable, indices: Sequence[int], res_shape: Tuple[int, ...]) -> numpy.ndarray:
+    if not isinstance(table, PackedTruthTable):
+        table = PackedTruthTable.from_table(table)
+    column = table.column.reshape(tuple(len(i.values) for i in table.inputs))
+    return broadcast_axes(column, indices, res_shape)
+
+
+# Reorders and reshapes the axes of array so that it broadcasts against res_shape, where indices gives the axis of
+# res_shape corresponding to each axis of array.
+def broadcast_axes(array: numpy.ndarray, indices: Sequence[int], res_shape: Tuple[int, ...]) -> numpy.ndarray:
+    order = sorted(range(len(indices)), key=lambda axis: indices[axis])
+    array = array.transpose(order)
+    shape = [1] * len(res_shape)
+    for axis in indices:
+        shape[axis] = res_shape[axis]
+    return array.reshape(shape)
+
 
-    return TruthTable(tuple(res_vars), res_tt)
+# Makes a table over inputs with the same output as table, which doesn't depend on the inputs it doesn't have. inputs
+# must include all of table's inputs, except ones with a single value.
+def expand_table(table: TruthTable, inputs: Sequence[Input]) -> PackedTruthTable:
+    if not isinstance(table, PackedTruthTable):
+        table = PackedTruthTable.from_table(table)
+    inputs = tuple(inputs)
+    column = table.column.reshape(tuple(len(i.values) for i in table.inputs))
+    selection: List[Union[int, slice]] = []
+    indices: List[int] = []
+    for i in table.inputs:
+        if i in inputs:
+            selection.append(slice(None))
+            indices.append(inputs.index(i))
+        elif len(i.values) == 1:
+            selection.append(0)
+        else:
+            raise ValueError(f"Input {i.tag} is missing.")
+    res_shape = tuple(len(i.values) for i in inputs)
+    res_column = numpy.broadcast_to(broadcast_axes(column[tuple(selection)], indices, res_shape), res_shape)
+    return PackedTruthTable(inputs, pack_column(res_column.ravel()), table.name)
+
+
+# The possible values of an input, in the order used to number truth table rows.
+def input_values(input_: Input) -> Tuple[BooleanValue, ...]:
+    return tuple(value for value in (F, T) if value in input_.values)
 
 
 def value_combinations(inputs: Sequence[Input]) -> List[Tuple[BooleanValue, ...]]:
-    return list(product(*map(lambda i: i.values, inputs)))
+    return list(product(*map(input_values, inputs)))
+
+
+# Packs a boolean column into little-endian bit order within uint64 words.
+def pack_column(column: numpy.ndarray) -> numpy.ndarray:
+    column = numpy.asarray(column, dtype=bool)
+    num_words = (len(column) + 63) // 64
+    padded = numpy.zeros(num_words * 64, dtype=bool)
+    padded[:len(column)] = column
+    packed = numpy.packbits(padded.reshape(-1, 8)[:, ::-1])
+    return packed.view("<u8").astype(numpy.uint64)
+
+
+# Inverse of pack_column().
+def unpack_column(bits: numpy.ndarray, size: int) -> numpy.ndarray:
+    unpacked = numpy.unpackbits(numpy.asarray(bits).astype("<u8").view(numpy.uint8))
+    return unpacked.reshape(-1, 8)[:, ::-1].ravel()[:size].astype(bool)
+
+
+# Counts the set bits in an array of uint64 words.
+def popcount(bits: numpy.ndarray) -> int:
+    bitwise_count = getattr(numpy, "bitwise_count", None)
+    if bitwise_count is not None:
+        return int(bitwise_count(bits).sum())
+    return int(numpy.unpackbits(numpy.asarray(bits).view(numpy.uint8)).sum())
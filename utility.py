@@ -1,19 +1,62 @@
-from typing import Any, Callable
+import stats
+
+from collections import deque
+from multiprocessing.pool import Pool
+from typing import Any, Callable, Deque, Iterable, Iterator
 
 
 __all__ = [
-    "cached_property"
+    "cached_property",
+    "ordered_map"
 ]
 
 
+# Computes a property once per object. The value is stored in the attribute named "_" followed by the property name,
+# which classes with __slots__ must declare as a slot.
 class cached_property:
     def __init__(self, fget: Callable[[Any], Any]) -> None:
         self.fget = fget
+        self.attr_name = "_" + fget.__name__
+        self.hits_name = f"cached_property.{fget.__name__}.hits"
+        self.misses_name = f"cached_property.{fget.__name__}.misses"
+
+    def is_cached(self, obj: Any) -> bool:
+        return hasattr(obj, self.attr_name)
+
+    def plain_get(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.attr_name)
+        except AttributeError:
+            result = self.fget(obj)
+            setattr(obj, self.attr_name, result)
+            return result
 
-    def __get__(self, obj, cls):
+    # Like plain_get(), but counts hits and misses in stats. stats.enable() switches __get__ between the two.
+    def counting_get(self, obj, cls):
         if obj is None:
             return self
-        else:
+        try:
+            result = getattr(obj, self.attr_name)
+        except AttributeError:
+            stats.increment(self.misses_name)
             result = self.fget(obj)
-            setattr(obj, self.fget.__name__, result)
+            setattr(obj, self.attr_name, result)
             return result
+        stats.increment(self.hits_name)
+        return result
+
+    __get__ = plain_get
+
+
+# Like Pool.imap(), but only reads window items ahead of the results consumed, so memory use stays bounded when
+# results are consumed slower than items are produced.
+def ordered_map(pool: Pool, function: Callable[[Any], Any], items: Iterable[Any], window: int) -> Iterator[Any]:
+    pending: Deque[Any] = deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()